@@ -0,0 +1,893 @@
+import gc
+import gzip
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+from bs4 import BeautifulSoup
+import grader
+import grader_client
+import grader_metrics
+import gspread
+import source_fetcher
+import gspread.urls
+from gspread.client import Client
+from gspread.parallel import ConcurrentClient
+from gspread.models import Cell, Worksheet, _xml_escape, _xml_escape_attrib
+from gspread.ns import _ns, _ns1, ATOM_NS, BATCH_NS, SPREADSHEET_NS
+from gspread.urls import construct_url
+from gspread.utils import finditem
+
+CELLS_BASE = "https://spreadsheets.google.com/feeds/cells/key/od6/private/full/"
+
+# Files of a replay fixture set. Grader pages are what -store saves, feeds
+# are saved as served, and utilities responses are the .txt files saved by
+# grader.py -record. Sets written by "fixtures" are synthetic instead, their
+# utilities responses are the submitted tables echoed back.
+FIXTURE_PROJECT = "project.txt"
+FIXTURE_WORKSHEETS = "worksheets.xml"
+FIXTURE_CELLS = "cells.xml"
+FIXTURE_GRADER = "user_stat.html"
+FIXTURE_MERGER = "merger.html"
+FIXTURE_NORMALIZER = "normalizer.html"
+CLASS_SIZES = [50, 500, 5000]
+PROBLEMS = 20
+
+LOGIN_PAGE = "<html><body><form method=\"post\" action=\"/login/login\"><input type=\"text\" name=\"login\"><input type=\"password\" name=\"password\"><input type=\"submit\" value=\"login\"></form></body></html>"
+
+
+def trim(st):
+    return st.strip(" \n\t")
+
+
+def legacy_extract_table(markup):
+    # Results table extraction as grader.update() used to do it
+    result_html = BeautifulSoup(markup)
+    result_table_html = result_html.find("table", class_="info")
+    if result_table_html is None:
+        return None
+    result_table = BeautifulSoup(str(result_table_html))
+    grader_result = []
+    for result_row in result_table("tr"):
+        result_cols = BeautifulSoup(str(result_row))
+        result_col = result_cols("td")
+        if len(result_col) <= 0:
+            result_col = result_cols("th")
+        orow = []
+        for col in result_col:
+            orow.append(trim(BeautifulSoup(str(col)).get_text()))
+        grader_result.append(orow)
+    return grader_result
+
+
+class LegacyCell(object):
+    # Cell as gspread used to keep it, with the whole feed entry attached
+    def __init__(self, worksheet, element):
+        self.element = element
+        cell_elem = element.find(_ns1("cell"))
+        self._row = int(cell_elem.get("row"))
+        self._col = int(cell_elem.get("col"))
+        self.input_value = cell_elem.get("inputValue")
+        numeric_value = cell_elem.get("numericValue")
+        self.numeric_value = float(numeric_value) if numeric_value else None
+        self.value = cell_elem.text or ""
+
+
+def legacy_update_feed(worksheet, cell_list):
+    # Batch update feed as Worksheet._create_update_feed used to build it
+    feed = ElementTree.Element("feed", {"xmlns": ATOM_NS,
+                                        "xmlns:batch": BATCH_NS,
+                                        "xmlns:gs": SPREADSHEET_NS})
+    ElementTree.SubElement(feed, "id").text = construct_url("cells", worksheet)
+    for cell in cell_list:
+        entry = ElementTree.SubElement(feed, "entry")
+        ElementTree.SubElement(entry, "batch:id").text = cell.element.find(_ns("title")).text
+        ElementTree.SubElement(entry, "batch:operation", {"type": "update"})
+        ElementTree.SubElement(entry, "id").text = cell.element.find(_ns("id")).text
+        edit_link = finditem(lambda x: x.get("rel") == "edit", cell.element.findall(_ns("link")))
+        ElementTree.SubElement(entry, "link", {"rel": "edit",
+                                               "type": edit_link.get("type"),
+                                               "href": edit_link.get("href")})
+        ElementTree.SubElement(entry, "gs:cell", {"row": str(cell._row),
+                                                  "col": str(cell._col),
+                                                  "inputValue": str(cell.value)})
+    return ElementTree.tostring(feed)
+
+
+class FeedWorksheet(object):
+    # Just enough of a worksheet to build cells feed URLs and update feeds
+    _MAX_FEED_SIZE = Worksheet._MAX_FEED_SIZE
+    _UPDATE_ENTRY = Worksheet._UPDATE_ENTRY
+    _iter_update_feeds = Worksheet.__dict__["_iter_update_feeds"]
+
+    def get_id_fields(self):
+        return {"spreadsheet_id": "key", "worksheet_id": "od6"}
+
+
+class FeedSession(object):
+    # Serves the same feed for every request instead of going to Google
+    def __init__(self, feed):
+        self.feed = feed
+
+    def get(self, url, **kwargs):
+        return io.BytesIO(self.feed)
+
+
+def cell_feed(cells, base=CELLS_BASE):
+    # Cells feed of (row, col, value) tuples, numbers get a numericValue
+    entries = []
+    for row, col, value in cells:
+        numeric = ""
+        try:
+            numeric = " numericValue=\"%s\"" % (float(value))
+        except ValueError:
+            pass
+        addr = "R%dC%d" % (row, col)
+        entries.append(
+            "<entry><id>%s%s</id><updated>2015-01-01T00:00:00.000Z</updated>"
+            "<category scheme=\"http://schemas.google.com/spreadsheets/2006\" term=\"http://schemas.google.com/spreadsheets/2006#cell\"/>"
+            "<title type=\"text\">%s</title><content type=\"text\">%s</content>"
+            "<link rel=\"self\" type=\"application/atom+xml\" href=\"%s%s\"/>"
+            "<link rel=\"edit\" type=\"application/atom+xml\" href=\"%s%s/1a2b\"/>"
+            "<gs:cell row=\"%d\" col=\"%d\" inputValue=\"%s\"%s>%s</gs:cell></entry>"
+            % (base, addr, addr, _xml_escape(value), base, addr, base, addr, row, col, _xml_escape_attrib(value), numeric, _xml_escape(value)))
+    return ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+            "<feed xmlns=\"%s\" xmlns:gs=\"%s\"><id>%s</id>%s</feed>"
+            % (ATOM_NS, SPREADSHEET_NS, base, str.join("", entries))).encode("utf-8")
+
+
+def cells_feed(rows, cols):
+    cells = []
+    for row in range(1, rows+1):
+        for col in range(1, cols+1):
+            if row == 1:
+                cells.append((row, col, "Header %d" % (col)))
+            else:
+                cells.append((row, col, str(row * col % 101)))
+    return cell_feed(cells)
+
+
+def grid_feed(grid):
+    # Cells feed of the non-empty values of a list of rows
+    return cell_feed((rownum+1, colnum+1, value) for rownum, row in enumerate(grid) for colnum, value in enumerate(row) if value != "")
+
+
+def deep_size(obj, shared):
+    # Bytes reachable from obj, not counting anything reachable from shared
+    seen = set(id(o) for o in shared)
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+    return size
+
+
+def measure(func, times):
+    timings = []
+    result = None
+    for i in range(times):
+        started = time.time()
+        result = func()
+        timings.append(time.time()-started)
+    timings.sort()
+    return (result, timings[len(timings) // 2], timings[0])
+
+
+def report(name, median, best, base=None):
+    line = "  %-10s median %9.3fms  best %9.3fms" % (name, median * 1000, best * 1000)
+    if base is not None and median > 0:
+        line += "  (%.1fx)" % (base / median)
+    print(line)
+
+
+def bench_table(args):
+    if len(args) < 1:
+        print("usage: table <stored result page> [times]")
+        return
+    times = 5
+    if len(args) > 1:
+        times = int(args[1])
+    f = open(args[0], "r")
+    markup = f.read()
+    f.close()
+    legacy, legacy_median, legacy_best = measure(lambda: legacy_extract_table(markup), times)
+    current, current_median, current_best = measure(lambda: grader_client.extract_table(markup), times)
+    if legacy is None:
+        print("Page has no results table")
+        return
+    print("Results table: %d rows, %d bytes page, %d runs" % (len(current), len(markup), times))
+    report("legacy", legacy_median, legacy_best)
+    report("current", current_median, current_best, legacy_median)
+    if legacy != current:
+        print("Warning! Extracted tables differ")
+
+
+def bench_cells(args):
+    count = 10000
+    times = 5
+    if len(args) > 0:
+        count = int(args[0])
+    if len(args) > 1:
+        times = int(args[1])
+    cols = 10
+    rows = max(1, count // cols)
+    feed = cells_feed(rows, cols)
+    worksheet = FeedWorksheet()
+    client = Client(None, http_session=FeedSession(feed))
+
+    def legacy_cells():
+        root = ElementTree.fromstring(feed)
+        return [LegacyCell(worksheet, elem) for elem in root.findall(_ns("entry"))]
+
+    def current_cells():
+        return [Cell(worksheet, elem) for elem in client.iter_cells_feed(worksheet)]
+
+    legacy, legacy_median, legacy_best = measure(legacy_cells, times)
+    current, current_median, current_best = measure(current_cells, times)
+    shared = [worksheet, ElementTree, sys.modules]
+    legacy_size = deep_size(legacy, shared)
+    current_size = deep_size(current, shared)
+    print("Cells feed: %d cells, %d bytes feed, %d runs" % (len(current), len(feed), times))
+    report("legacy", legacy_median, legacy_best)
+    report("current", current_median, current_best, legacy_median)
+    print("  %-10s %9.1fKB  %6d bytes/cell" % ("legacy", legacy_size / 1024.0, legacy_size // len(legacy)))
+    print("  %-10s %9.1fKB  %6d bytes/cell  (%.1fx)" % ("current", current_size / 1024.0, current_size // len(current), float(legacy_size) / current_size))
+    if [(c._row, c._col, c.value, c.input_value, c.numeric_value) for c in legacy] != [(c.row, c.col, c.value, c.input_value, c.numeric_value) for c in current]:
+        print("Warning! Parsed cells differ")
+
+
+def bench_feed(args):
+    count = 10000
+    times = 5
+    if len(args) > 0:
+        count = int(args[0])
+    if len(args) > 1:
+        times = int(args[1])
+    cols = 10
+    feed = cells_feed(max(1, count // cols), cols)
+    worksheet = FeedWorksheet()
+    root = ElementTree.fromstring(feed)
+    legacy_list = [LegacyCell(worksheet, elem) for elem in root.findall(_ns("entry"))]
+    cell_list = [Cell(worksheet, elem) for elem in root.findall(_ns("entry"))]
+
+    legacy, legacy_median, legacy_best = measure(lambda: legacy_update_feed(worksheet, legacy_list), times)
+    current, current_median, current_best = measure(lambda: list(worksheet._iter_update_feeds(cell_list)), times)
+    print("Update feed: %d cells, %d bytes in %d request(s), %d runs" % (len(cell_list), sum(len(f) for f in current), len(current), times))
+    report("legacy", legacy_median, legacy_best)
+    report("current", current_median, current_best, legacy_median)
+    entries = []
+    for f in current:
+        entries.extend(ElementTree.tostring(e) for e in ElementTree.fromstring(f).findall(_ns("entry")))
+    if entries != [ElementTree.tostring(e) for e in ElementTree.fromstring(legacy).findall(_ns("entry"))]:
+        print("Warning! Update feeds differ")
+
+
+class FixtureWorksheet(object):
+    # Just enough of a worksheet to read cell labels
+    _cell_addr_re = Worksheet._cell_addr_re
+    _MAGIC_NUMBER = Worksheet._MAGIC_NUMBER
+    get_int_addr = Worksheet.__dict__["get_int_addr"]
+
+
+def form_page(fields):
+    # Utilities API form as the stand-in serves it
+    controls = []
+    for name in fields:
+        if name.startswith("source"):
+            controls.append("<textarea name=\"%s\"></textarea>" % (name))
+        else:
+            controls.append("<input type=\"text\" name=\"%s\">" % (name))
+    return "<html><body><form method=\"post\">%s<input type=\"submit\" value=\"submit\"></form></body></html>" % (str.join("", controls))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, content_type="text/html", headers={}, status=200):
+        if len(body) > 0 and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = self.server.gzip(body)
+            headers = dict(headers, **{"Content-Encoding": "gzip"})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if (self.headers.get("Content-Encoding") or "").lower() == "gzip":
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        return data
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/feeds/worksheets/"):
+            return self.reply(self.server.fixture(FIXTURE_WORKSHEETS), "application/atom+xml")
+        if url.path.startswith("/feeds/cells/"):
+            etag = "\"replay-%d\"" % (self.server.version)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if "range" in query:
+                return self.reply(self.server.range_feed(query["range"][0]), "application/atom+xml", {"ETag": etag})
+            return self.reply(self.server.cells_feed(), "application/atom+xml", {"ETag": etag})
+        if url.path.endswith("/merger.php"):
+            return self.reply(form_page(grader.MERGER_FIELDS))
+        if url.path.endswith("/normalizer.php"):
+            return self.reply(form_page(grader.NORMALIZER_FIELDS))
+        if url.path.startswith("/user_admin/user_stat") and "replay=1" in (self.headers.get("Cookie") or ""):
+            return self.reply(self.server.fixture(FIXTURE_GRADER))
+        self.reply(LOGIN_PAGE)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        data = self.body()
+        if url.path.startswith("/feeds/cells/"):
+            self.server.apply(data)
+            return self.reply(("<?xml version=\"1.0\" encoding=\"UTF-8\"?><feed xmlns=\"%s\" xmlns:batch=\"%s\"><id>%s</id></feed>" % (ATOM_NS, BATCH_NS, url.path)).encode("utf-8"), "application/atom+xml")
+        if url.path.startswith("/login/"):
+            return self.reply("<html><body>Welcome</body></html>", headers={"Set-Cookie": "replay=1; path=/"})
+        form = dict((name, values[0]) for name, values in parse_qs(data, keep_blank_values=True).items())
+        if url.path.endswith("/merger.php"):
+            return self.reply(self.server.respond(FIXTURE_MERGER, lambda: form.get("source2", "")), "text/plain")
+        if url.path.endswith("/normalizer.php"):
+            return self.reply(self.server.respond(FIXTURE_NORMALIZER, lambda: form.get("source", "")), "text/plain")
+        self.reply("Not found", "text/plain", status=404)
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    # Local stand-in for Google Sheets, the grader and the utilities server
+    # answering from a fixture set. Only when recording are missing
+    # utilities responses made up, by echoing the submitted table, and
+    # saved to the set.
+    daemon_threads = True
+
+    def __init__(self, path, record=False):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), ReplayHandler)
+        self.path = path
+        self.record = record
+        self.base = "http://127.0.0.1:%d" % (self.server_address[1])
+        self.version = 0
+        self.changed = False
+        self.files = {}
+        self.gzipped = {}
+        self.lock = threading.Lock()
+        self.worksheet = FixtureWorksheet()
+        self.cells = {}
+        for event, elem in ElementTree.iterparse(io.BytesIO(self.fixture(FIXTURE_CELLS))):
+            if elem.tag == _ns1("cell"):
+                self.cells[(int(elem.get("row")), int(elem.get("col")))] = elem.get("inputValue") or elem.text or ""
+            elif elem.tag == _ns("entry"):
+                elem.clear()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def fixture(self, name):
+        with self.lock:
+            if name not in self.files:
+                f = open(os.path.join(self.path, name), "rb")
+                self.files[name] = f.read()
+                f.close()
+            return self.files[name]
+
+    def gzip(self, body):
+        # Fixtures are compressed once, like a server caching static feeds
+        with self.lock:
+            for name, data in self.files.items():
+                if data is body:
+                    if name not in self.gzipped:
+                        self.gzipped[name] = compress(body)
+                    return self.gzipped[name]
+        return compress(body)
+
+    def apply(self, data):
+        # Batch updates are applied to the worksheet, so later cycles see
+        # the cells they wrote like on Google Sheets
+        with self.lock:
+            for cell in ElementTree.fromstring(data).iter(_ns1("cell")):
+                key = (int(cell.get("row")), int(cell.get("col")))
+                value = cell.get("inputValue") or ""
+                if value == "":
+                    self.cells.pop(key, None)
+                else:
+                    self.cells[key] = value
+            self.version += 1
+            self.changed = True
+
+    def cells_feed(self):
+        # The recorded feed until a batch update changes the worksheet
+        with self.lock:
+            if self.changed:
+                self.files[FIXTURE_CELLS] = cell_feed(sorted((row, col, value) for (row, col), value in self.cells.items()))
+                self.gzipped.pop(FIXTURE_CELLS, None)
+                self.changed = False
+        return self.fixture(FIXTURE_CELLS)
+
+    def range_feed(self, alphanum):
+        # Every cell of the range, empty ones included, as return-empty asks
+        first, last = (alphanum.split(":") + [alphanum])[:2]
+        first_row, first_col = self.worksheet.get_int_addr(first)
+        last_row, last_col = self.worksheet.get_int_addr(last)
+        cells = [(row, col, self.cells.get((row, col), "")) for row in range(first_row, last_row+1) for col in range(first_col, last_col+1)]
+        return cell_feed(cells, self.base + "/feeds/cells/key/od6/private/full/")
+
+    def respond(self, name, compute):
+        if not self.record or os.path.exists(os.path.join(self.path, name)):
+            return self.fixture(name)
+        response = compute()
+        f = open(os.path.join(self.path, name), "wb")
+        f.write(response)
+        f.close()
+        return response
+
+
+def compress(body):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(body)
+    f.close()
+    return buf.getvalue()
+
+
+class ReplayCredentials(object):
+    # OAuth2 credentials that never expire, the stand-in accepts any token
+    access_token = "replay"
+    access_token_expired = False
+
+
+class RecordList(list):
+    # Keeps cycle records in memory in place of a grader_metrics.MetricsLog
+    def write(self, record):
+        self.append(record)
+
+
+def class_results(students, problems, seed):
+    # Grader results table of a synthetic class, and the same table from an
+    # earlier update with some problems not yet solved
+    rand = random.Random(seed)
+    head = ["User", "Name", "Activated?", "Logged in", "Contest(s)", "Remark"] + ["prob%d" % (problem+1) for problem in range(problems)] + ["Total", "Passed"]
+    current = [head]
+    earlier = [head]
+    for student in range(students):
+        scores = [rand.choice([0, 0, 50, 100, 100, 100]) for problem in range(problems)]
+        earlier_scores = [0 if rand.random() < 0.1 else score for score in scores]
+        info = ["b%07d" % (5700000+student), "Student %d" % (student+1), "true", rand.choice(["yes", "no"]), "sec%d" % (student % 4 + 1), ""]
+        for table, row_scores in [(current, scores), (earlier, earlier_scores)]:
+            passed = len([score for score in row_scores if score >= 100])
+            table.append(info + [str(score) for score in row_scores] + [str(sum(row_scores)), str(passed)])
+    return (current, earlier)
+
+
+def results_page(table):
+    # Results page laid out as the grader's user_stat page
+    rows = ["<tr class='info-head'>" + str.join("", ["<th>%s</th>" % (_xml_escape(col)) for col in table[0]]) + "</tr>"]
+    for rownum, row in enumerate(table[1:]):
+        cols = ["<td>\n  <a href='/user_admin/stat/%d'>%s</a>\n</td>" % (rownum, _xml_escape(row[0]))] + ["<td>\n  %s\n</td>" % (_xml_escape(col)) for col in row[1:]]
+        rows.append("<tr class='info-%s'>%s</tr>" % ("even" if rownum % 2 == 0 else "odd", str.join("", cols)))
+    return "<html><head><title>Grader</title></head><body><h1>User stat</h1><table class='info'>%s</table></body></html>" % (str.join("\n", rows))
+
+
+def write_fixtures(path, students, problems=PROBLEMS, seed=0):
+    # Synthetic fixture set for a class, its worksheet holding the earlier
+    # results. Its utilities responses are not from the utilities server,
+    # they echo the submitted tables while replaying the set once, so the
+    # set only exercises the pipeline.
+    if not os.path.exists(path):
+        os.makedirs(path)
+    current, earlier = class_results(students, problems, seed)
+    project = ["replay", "replay", "replay", "replay", "key", "Scores",
+               "Activated?,Logged in,Remark", "", "", "",
+               "", str.join(",", current[0][6:6+problems]), "", "", ""]
+    grid = earlier
+    rows = len(grid) + 10
+    cols = max(len(row) for row in grid)
+    worksheets = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+                  "<feed xmlns=\"%s\" xmlns:gs=\"%s\"><id>https://spreadsheets.google.com/feeds/worksheets/key/private/full</id><title type=\"text\">Replay</title>"
+                  "<entry><id>https://spreadsheets.google.com/feeds/worksheets/key/private/full/od6</id><title type=\"text\">Scores</title>"
+                  "<link rel=\"http://schemas.google.com/spreadsheets/2006#cellsfeed\" type=\"application/atom+xml\" href=\"%s\"/>"
+                  "<link rel=\"self\" type=\"application/atom+xml\" href=\"https://spreadsheets.google.com/feeds/worksheets/key/private/full/od6\"/>"
+                  "<link rel=\"edit\" type=\"application/atom+xml\" href=\"https://spreadsheets.google.com/feeds/worksheets/key/private/full/od6/1a2b\"/>"
+                  "<gs:rowCount>%d</gs:rowCount><gs:colCount>%d</gs:colCount></entry></feed>"
+                  % (ATOM_NS, SPREADSHEET_NS, CELLS_BASE, rows, cols))
+    files = {
+        FIXTURE_PROJECT: str.join("\n", project),
+        FIXTURE_WORKSHEETS: worksheets.encode("utf-8"),
+        FIXTURE_CELLS: grid_feed(grid),
+        FIXTURE_GRADER: results_page(current)
+    }
+    for name, data in files.items():
+        f = open(os.path.join(path, name), "wb")
+        f.write(data)
+        f.close()
+    for name in [FIXTURE_MERGER, FIXTURE_NORMALIZER]:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    replay(path, 1, True)
+
+
+def replay(path, cycles, record=False):
+    # Runs update cycles of the fixture set's project against a stand-in
+    # server and returns their grader_metrics records, the first cycle
+    # (grader login, opening the spreadsheet) included
+    if not record:
+        for name in [FIXTURE_PROJECT, FIXTURE_WORKSHEETS, FIXTURE_CELLS, FIXTURE_GRADER, FIXTURE_MERGER, FIXTURE_NORMALIZER]:
+            if not os.path.exists(os.path.join(path, name)):
+                print("Missing fixture " + os.path.join(path, name))
+                return None
+    server = ReplayServer(path, record)
+    saved = (gspread.urls.SPREADSHEETS_FEED_URL, grader_client.GRADER_BASE, grader_client.COOKIE_DIR, grader.UTILS_BASE, grader.SHEET_RATE_LIMIT)
+    cookie_dir = tempfile.mkdtemp()
+    gspread.urls.SPREADSHEETS_FEED_URL = server.base + "/feeds/"
+    grader_client.GRADER_BASE = server.base
+    grader_client.COOKIE_DIR = cookie_dir
+    grader.UTILS_BASE = server.base + "/utils"
+    # Measure the pipeline, not the time spent waiting on Google's quota
+    grader.SHEET_RATE_LIMIT = None
+    session = grader.new_session()
+    try:
+        file_info = grader.load_project(os.path.join(path, FIXTURE_PROJECT))
+        if file_info is None:
+            return None
+        flags = grader.default_flags()
+        flags["n"] = -1
+        flags["l"] = 0
+        flags["force"] = True
+        flags["silent"] = True
+        flags["first"] = False
+        flags["credentials"] = ReplayCredentials()
+        flags["metrics"] = RecordList()
+        for cycle in range(cycles):
+            if not grader.update_cycle(os.path.basename(os.path.normpath(path)), file_info, flags, session):
+                print("Update failed on " + path)
+                return None
+        return flags["metrics"]
+    finally:
+        # Kept-alive connections are closed first so no request is left
+        # waiting on the stand-in
+        if session["client"] is not None:
+            session["client"].session.close()
+        if session["grader"] is not None:
+            session["grader"].browser.close()
+        server.shutdown()
+        server.server_close()
+        gspread.urls.SPREADSHEETS_FEED_URL, grader_client.GRADER_BASE, grader_client.COOKIE_DIR, grader.UTILS_BASE, grader.SHEET_RATE_LIMIT = saved
+        shutil.rmtree(cookie_dir)
+
+
+def fixture_sets(path):
+    # The fixture set at path, or the ones in its subdirectories
+    if os.path.exists(os.path.join(path, FIXTURE_PROJECT)):
+        return [path]
+    names = [name for name in os.listdir(path) if os.path.exists(os.path.join(path, name, FIXTURE_PROJECT))]
+    names.sort(key=lambda name: (not name.isdigit(), int(name) if name.isdigit() else 0, name))
+    return [os.path.join(path, name) for name in names]
+
+
+def bench_fixtures(args):
+    if len(args) < 1:
+        print("usage: fixtures <directory> [students...]")
+        return
+    sizes = [int(size) for size in args[1:]] or CLASS_SIZES
+    for students in sizes:
+        started = time.time()
+        write_fixtures(os.path.join(args[0], str(students)), students)
+        print("Fixtures for %d students written in %.3fs" % (students, time.time()-started))
+
+
+def bench_replay(args):
+    cycles = 3
+    if len(args) > 0:
+        cycles = int(args[0])
+    temporary = None
+    if len(args) > 1:
+        paths = fixture_sets(args[1])
+    else:
+        temporary = tempfile.mkdtemp()
+        bench_fixtures([temporary])
+        paths = fixture_sets(temporary)
+    try:
+        for path in paths:
+            f = open(os.path.join(path, FIXTURE_GRADER), "r")
+            rows = grader_client.extract_table(f.read()) or []
+            f.close()
+            records = replay(path, cycles + 1)
+            if records is None:
+                continue
+            first, records = records[0], records[1:]
+            elapsed = sum(float(record["total_ms"]) for record in records) / 1000
+            students = max(0, len(rows)-1)
+            print("Replay %s: %d students, %d cycle(s) in %.3fs (first cycle %.3fs)" % (path, students, len(records), elapsed, first["total_ms"] / 1000))
+            if elapsed > 0:
+                print("  %.2f cycles/s, %.0f students/s" % (len(records) / elapsed, len(records) * students / elapsed))
+            for line in grader_metrics.summarize(records):
+                print("  " + line)
+    finally:
+        if temporary is not None:
+            shutil.rmtree(temporary)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.startswith("/feeds/worksheets/"):
+            return self.reply(self.server.worksheets_feed())
+        with self.server.lock:
+            self.server.running += 1
+            self.server.peak = max(self.server.peak, self.server.running)
+        try:
+            time.sleep(self.server.delay)
+            worksheet = path.split("/")[4]
+            with self.server.lock:
+                cells = sorted((row, col, value) for (sheet, row, col), value in self.server.cells.items() if sheet == worksheet)
+            self.reply(cell_feed(cells, self.server.base + "/feeds/cells/key/" + worksheet + "/private/full/"))
+        finally:
+            with self.server.lock:
+                self.server.running -= 1
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if (self.headers.get("Content-Encoding") or "").lower() == "gzip":
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        worksheet = path.split("/")[4]
+        with self.server.lock:
+            for cell in ElementTree.fromstring(data).iter(_ns1("cell")):
+                self.server.cells[(worksheet, int(cell.get("row")), int(cell.get("col")))] = cell.get("inputValue")
+        self.reply(("<?xml version=\"1.0\" encoding=\"UTF-8\"?><feed xmlns=\"%s\" xmlns:batch=\"%s\"><id>%s</id></feed>" % (ATOM_NS, BATCH_NS, path)).encode("utf-8"))
+
+
+class FeedServer(ThreadingMixIn, HTTPServer):
+    # Fake Sheets feed server with a spreadsheet of several worksheets,
+    # answering cell feeds after a delay and counting how many it answers
+    # at once
+    daemon_threads = True
+
+    def __init__(self, worksheets, rows, cols, delay):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FeedHandler)
+        self.base = "http://127.0.0.1:%d" % (self.server_address[1])
+        self.worksheets = ["od%d" % (sheet+1) for sheet in range(worksheets)]
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.cells = {}
+        for sheet in self.worksheets:
+            for row in range(1, rows+1):
+                for col in range(1, cols+1):
+                    self.cells[(sheet, row, col)] = "%s %d" % (sheet, row * col)
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def worksheets_feed(self):
+        base = self.base + "/feeds/worksheets/key/private/full"
+        entries = ["<entry><id>%s/%s</id><title type=\"text\">%s</title>"
+                   "<link rel=\"self\" type=\"application/atom+xml\" href=\"%s/%s\"/>"
+                   "<link rel=\"edit\" type=\"application/atom+xml\" href=\"%s/%s/1a2b\"/>"
+                   "<gs:rowCount>1000</gs:rowCount><gs:colCount>26</gs:colCount></entry>"
+                   % (base, sheet, sheet, base, sheet, base, sheet) for sheet in self.worksheets]
+        return ("<?xml version=\"1.0\" encoding=\"UTF-8\"?><feed xmlns=\"%s\" xmlns:gs=\"%s\"><id>%s</id><title type=\"text\">Feed</title>%s</feed>"
+                % (ATOM_NS, SPREADSHEET_NS, base, str.join("", entries))).encode("utf-8")
+
+
+def bench_concurrent(args):
+    # Reads and writes worksheets of a fake feed server one after another
+    # and through a ConcurrentClient, and checks both see the same cells
+    worksheets = 8
+    delay = 100
+    max_per_host = 4
+    if len(args) > 0:
+        worksheets = int(args[0])
+    if len(args) > 1:
+        delay = int(args[1])
+    if len(args) > 2:
+        max_per_host = int(args[2])
+    server = FeedServer(worksheets, 50, 10, delay / 1000.0)
+    saved = gspread.urls.SPREADSHEETS_FEED_URL
+    gspread.urls.SPREADSHEETS_FEED_URL = server.base + "/feeds/"
+    client = gspread.authorize(ReplayCredentials())
+    pool = ConcurrentClient(client, max_workers=worksheets, max_per_host=max_per_host)
+    try:
+        sheets = client.open_by_key("key").worksheets()
+        started = time.time()
+        sequential = [sheet.get_all_values() for sheet in sheets]
+        sequential_time = time.time()-started
+        sequential_peak, server.peak = server.peak, 0
+        started = time.time()
+        concurrent = pool.gather(*[pool.get_all_values(sheet) for sheet in sheets])
+        concurrent_time = time.time()-started
+        concurrent_peak = server.peak
+        pool.gather(*[pool.update_cells(sheet, [sheet._new_cell(1, 1, sheet.title + " updated")]) for sheet in sheets])
+        updated = pool.gather(*[pool.get_all_values(sheet) for sheet in sheets])
+    finally:
+        pool.close()
+        client.session.close()
+        server.shutdown()
+        server.server_close()
+        gspread.urls.SPREADSHEETS_FEED_URL = saved
+    print("Concurrent reads: %d worksheets, %dms per feed, at most %d at once" % (len(sheets), delay, max_per_host))
+    print("  %-10s %9.3fms  %d at once" % ("sequential", sequential_time * 1000, sequential_peak))
+    print("  %-10s %9.3fms  %d at once  (%.1fx)" % ("concurrent", concurrent_time * 1000, concurrent_peak, sequential_time / concurrent_time))
+    ok = True
+    if concurrent != sequential:
+        print("Warning! Concurrent reads differ from sequential reads")
+        ok = False
+    if concurrent_peak > max_per_host:
+        print("Warning! %d feeds were read at once" % (concurrent_peak))
+        ok = False
+    if [values[0][0] for values in updated] != [sheet.title + " updated" for sheet in sheets]:
+        print("Warning! Concurrent updates were not applied")
+        ok = False
+    return ok
+
+
+class DownloadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, headers={}):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.startswith("/download") or "download=1" not in (self.headers.get("Cookie") or ""):
+            return self.reply(LOGIN_PAGE)
+        # Written in blocks, the server never holds the whole file either
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Disposition", "attachment; filename=\"download.txt\"")
+        self.send_header("Content-Length", str(self.server.size))
+        self.end_headers()
+        block = b"x" * 65536
+        sent = 0
+        while sent < self.server.size:
+            chunk = block[:self.server.size-sent]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.reply("<html><body>Welcome</body></html>", {"Set-Cookie": "download=1; path=/"})
+
+
+class DownloadServer(ThreadingMixIn, HTTPServer):
+    # Fake grader serving a source file of the given size after a login
+    daemon_threads = True
+
+    def __init__(self, size):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), DownloadHandler)
+        self.base = "http://127.0.0.1:%d" % (self.server_address[1])
+        self.size = size
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def peak_memory():
+    # Peak resident memory of the process in KB
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return usage / 1024
+    return usage
+
+
+def bench_download(args):
+    # Saves a large source through GraderSession.stream as source_fetcher
+    # does, then through the browser, and checks that streaming does not
+    # raise the peak memory by a fraction of the file
+    megabytes = 16
+    if len(args) > 0:
+        megabytes = int(args[0])
+    if resource is None:
+        print("The download benchmark needs the resource module")
+        return False
+    size = megabytes * 1024 * 1024
+    server = DownloadServer(size)
+    session = grader_client.GraderSession("download", "download", None, server.base)
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        # Streaming goes first, the browser's copy would raise the peak
+        for name, open_download in [("stream", session.stream), ("browser", session.open)]:
+            gc.collect()
+            before = peak_memory()
+            started = time.time()
+            response = open_download("/download")
+            tmp_path, received, digest = source_fetcher.save_source(response, os.path.join(directory, name + ".txt"))
+            response.close()
+            results.append((name, time.time()-started, received, peak_memory()-before))
+    finally:
+        session.browser.close()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+    print("Download of %dMB through the grader session" % (megabytes))
+    for name, elapsed, received, grown in results:
+        print("  %-8s %9.3fms  peak memory +%dKB" % (name, elapsed * 1000, grown))
+    ok = True
+    if [received for name, elapsed, received, grown in results] != [size, size]:
+        print("Warning! Downloads are incomplete")
+        ok = False
+    if results[0][3] > size / 1024 / 4:
+        print("Warning! Streaming raised the peak memory by %dKB" % (results[0][3]))
+        ok = False
+    return ok
+
+
+def run(args):
+    benchmarks = {
+        "table": bench_table,
+        "cells": bench_cells,
+        "feed": bench_feed,
+        "fixtures": bench_fixtures,
+        "replay": bench_replay,
+        "concurrent": bench_concurrent,
+        "download": bench_download
+    }
+    if len(args) < 2 or args[1] not in benchmarks:
+        print("usage: " + args[0] + " <benchmark> [arguments]")
+        print("Benchmarks:")
+        print("  table <page> [times]\t: Grader results table extraction on a -store page")
+        print("  cells [count] [times]\t: Worksheet cells feed parsing time and memory")
+        print("  feed [count] [times]\t: Worksheet batch update feed building")
+        print("  fixtures <directory> [students...]\t: Write synthetic replay fixtures with echoed utilities responses (default is 50, 500 and 5000 students)")
+        print("  replay [cycles] [fixtures]\t: Update cycles against local stand-ins replaying fixtures (default is synthetic classes)")
+        print("  concurrent [worksheets] [delay ms] [max per host]\t: ConcurrentClient reads and writes against a fake feed server")
+        print("  download [megabytes]\t: Peak memory of streaming a large source file from a fake grader")
+        return
+    return benchmarks[args[1]](args[2:])
+
+
+if __name__ == "__main__":
+    if run(sys.argv) is False:
+        sys.exit(1)
@@ -1,17 +1,31 @@
 import getpass
+import json
 import os
+import random
 import re
 import sys
+import threading
 import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import gspread
-import mechanize
-from bs4 import BeautifulSoup
 from oauth2client.client import OAuth2WebServerFlow
+import grader_client
+import grader_metrics
 
 
 OAUTH_SCOPES = ["https://spreadsheets.google.com/feeds"]
-GRADER_BASE = "http://grader.eng.src.ku.ac.th"
 UTILS_BASE = "http://digitalparticle.com/graderta"
+SHEET_CACHE_SIZE = 4
+SHEET_RATE_LIMIT = 5
+# Form fields of the utilities server APIs
+MERGER_FIELDS = ["source1", "source2", "no_columns", "no_rows", "keep_columns", "keep_rows"]
+NORMALIZER_FIELDS = ["source", "include_contests", "calculate_columns", "withdrawn_users", "exclude_users", "include_columns", "datetime"]
+
+print_lock = threading.Lock()
+record_lock = threading.Lock()
 
 
 def parse_file(data):
@@ -50,12 +64,121 @@ def trim(st):
     return st
 
 
+def log(name, message):
+    with print_lock:
+        if name is None:
+            print(message)
+        else:
+            print("[" + name + "] " + message)
+
+
+def load_project(input_file):
+    if not os.path.exists(input_file):
+        print("File is not exists")
+        return None
+    f = open(input_file, "r")
+    if f is None:
+        print("Error occured while reading a file")
+        return None
+    file_info = parse_file(f.read())
+    f.close()
+    return file_info
+
+
+def get_credentials(file_info):
+    flow = OAuth2WebServerFlow(file_info["client_id"], file_info["client_secret"], " ".join(OAUTH_SCOPES))
+    flow_info = flow.step1_get_device_and_user_codes()
+    print("Enter the following code at {0}: {1}".format(flow_info.verification_url,
+                                                        flow_info.user_code))
+    raw_input("Then press Enter/Return.")
+    try:
+        return flow.step2_exchange(device_flow_info=flow_info)
+    except:
+        print("Failed to get user credentials.")
+        return None
+
+
+def diff_cells(rows, result_list):
+    # Map (row, col) of every cell whose value differs from the worksheet
+    # to its new value. Blank results keep the existing cell value.
+    changed_cells = {}
+    width = len(result_list[0])
+    for rownum in range(len(result_list)):
+        for colnum in range(min(width, len(result_list[rownum]))):
+            value = result_list[rownum][colnum]
+            if value is None:
+                value = ""
+            elif trim(value) != "":
+                value = value.decode("utf8")
+            else:
+                continue
+            old_value = ""
+            if rownum < len(rows) and colnum < len(rows[rownum]):
+                old_value = rows[rownum][colnum]
+            if value != old_value:
+                changed_cells[(rownum+1, colnum+1)] = value
+    return changed_cells
+
+
+def api_result(page):
+    # Result text of a utilities server response, without the script it ends with
+    return re.sub("<script.*$", "", page)
+
+
+def record_exchange(path, api, fields, response):
+    # Saves the form fields submitted to the utilities server as <name>.json
+    # and its raw response as <name>.txt
+    with record_lock:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        name = api + "-" + time.strftime("%Y%m%d%H%M%S", time.localtime())
+        suffix = 1
+        while os.path.exists(os.path.join(path, name + ".json")):
+            suffix += 1
+            name = api + "-" + time.strftime("%Y%m%d%H%M%S", time.localtime()) + "-" + str(suffix)
+        f = open(os.path.join(path, name + ".json"), "w")
+        f.write(json.dumps({"api": api, "fields": fields}, indent=1, sort_keys=True))
+        f.close()
+        f = open(os.path.join(path, name + ".txt"), "wb")
+        f.write(response)
+        f.close()
+        return name
+
+
+def default_flags():
+    return {
+        # Repeat times
+        "n": 1,
+        # Delay between each times
+        "l": 60,
+        "store_source": False,
+        "force": False,
+        "silent": False,
+        "autoretry": False,
+        "pause_google": False,
+        "pause_grader": False,
+        "pause_merger": False,
+        "pause_normalizer": False,
+        "pause_update": False,
+        "first": True,
+        "score": None,
+        "credentials": None,
+        "workers": 4,
+        "jitter": 0,
+        "tick": 5,
+        "metrics": None,
+        "record": None
+    }
+
+
 def run(args):
     if len(args) < 2:
         print("usage: " + args[0] + " [option] <project_file> [flags]")
         print("Options:")
         print("  new\t: Create a new grader project")
         print("  edit\t: Change grader project settings")
+        print("  schedule\t: Update many projects from one process (give each as <project_file>[@<delay>])")
+        print("  summary\t: Report p50/p95 stage timings of a metrics file (give the metrics file as <project_file>)")
         print("Flags:")
         print("  -score <file name>\t: Read grader's score from file")
         print("  -autoretry\t: Repeat update on uncritical errors")
@@ -70,25 +193,13 @@ def run(args):
         print("  -force\t: Force update on warning (if any)")
         print("  -store\t: Save fetched result page to file")
         print("  -silent\t: Update result without printing anything")
+        print("  -record <directory>\t: Save requests and responses of the utilities server to directory")
+        print("  -j <num>\t: Projects updated at the same time in schedule mode (default is 4)")
+        print("  -jitter <num>\t: Random extra delay of up to <num> seconds in schedule mode (default is 0)")
+        print("  -tick <num>\t: Seconds between schedule checks, projects due in the same tick share grader pages (default is 5)")
+        print("  -metrics <file name>\t: Log stage timings, requests and bytes of each update (CSV for *.csv, JSON lines otherwise)")
         return
-    flags = {
-        # Repeat times
-        "n": 1,
-        # Delay between each times
-        "l": 60,
-        "store_source": False,
-        "force": False,
-        "silent": False,
-        "autoretry": False,
-        "pause_google": False,
-        "pause_grader": False,
-        "pause_merger": False,
-        "pause_normalizer": False,
-        "pause_update": False,
-        "first": True,
-        "score": None,
-        "credentials": None
-    }
+    flags = default_flags()
     for aid in range(2, len(args)):
         if args[aid] == "-autoretry":
             flags["autoretry"] = True
@@ -121,6 +232,19 @@ def run(args):
                     flags["pause_normalizer"] = True
                 elif breakpoint == "update":
                     flags["pause_update"] = True
+        elif args[aid] == "-j":
+            if int(args[aid+1]) > 0:
+                flags["workers"] = int(args[aid+1])
+        elif args[aid] == "-jitter":
+            if int(args[aid+1]) >= 0:
+                flags["jitter"] = int(args[aid+1])
+        elif args[aid] == "-tick":
+            if int(args[aid+1]) > 0:
+                flags["tick"] = int(args[aid+1])
+        elif args[aid] == "-record":
+            flags["record"] = args[aid+1]
+        elif args[aid] == "-metrics":
+            flags["metrics"] = grader_metrics.MetricsLog(args[aid+1])
         elif args[aid] == "-final":
             flags["pause_google"] = True
             flags["pause_grader"] = True
@@ -129,7 +253,26 @@ def run(args):
             flags["pause_update"] = True
     input_file = args[1]
     mode = ""
-    if args[1] == "new":
+    if args[1] == "schedule":
+        input_files = []
+        valued_flags = ["-score", "-n", "-times", "-l", "-delay", "-break", "-j", "-jitter", "-tick", "-metrics", "-record"]
+        for aid in range(2, len(args)):
+            if not args[aid].startswith("-") and args[aid-1] not in valued_flags:
+                input_files.append(args[aid])
+        schedule(input_files, flags)
+        return
+    elif args[1] == "summary":
+        if len(args) < 3:
+            print("usage: " + args[0] + " summary <metrics_file>")
+            return
+        records = grader_metrics.load(args[2])
+        if len(records) < 1:
+            print("No update recorded in " + args[2])
+            return
+        for line in grader_metrics.summarize(records):
+            print(line)
+        return
+    elif args[1] == "new":
         mode = "new"
         input_file = args[2]
     elif args[1] == "edit":
@@ -153,23 +296,15 @@ def update(mode="", input_file="", flags={}):
             if graderp == "":
                 return
             print("Connecting to grader...")
-            br = mechanize.Browser()
-            br.set_handle_robots(False)
+            print("Logging into grader...")
             try:
-                br.open(GRADER_BASE)
+                grader_client.GraderSession(graderu, graderp).login()
+            except grader_client.LoginError:
+                print("Invalid user or password.")
+                continue
             except Exception as msg:
                 print("Grader Error! "+str(msg))
                 return
-            if len(list(br.forms())) < 1:
-                print("No login form in grader... Please check the grader...")
-                return
-            br.form = list(br.forms())[0]
-            br.form["login"] = graderu
-            br.form["password"] = graderp
-            print("Logging into grader...")
-            if re.search("Wrong password", br.submit().read()) is not None:
-                print("Invalid user or password.")
-                continue
             break
         while True:
             print("==== GMail ====")
@@ -600,15 +735,9 @@ def update(mode="", input_file="", flags={}):
                 continue
             break
         return
-    if not os.path.exists(input_file):
-        print("File is not exists")
-        return
-    f = open(input_file, "r")
-    if f is None:
-        print("Error occured while reading a file")
+    file_info = load_project(input_file)
+    if file_info is None:
         return
-    file_info = parse_file(f.read())
-    f.close()
 
     if flags["first"] and not flags["silent"]:
         print("==== Grader ====")
@@ -636,66 +765,135 @@ def update(mode="", input_file="", flags={}):
             if confirm.lower() == "n" or confirm.lower() == "cancel":
                 return
 
-    # ======
-    # Retry loop
-    # ======
-    retry = 0
-    started = time.mktime(time.localtime())
-
     if not flags["credentials"]:
         if not flags["silent"]:
             print("Getting user credential...")
-        flow = OAuth2WebServerFlow(file_info["client_id"], file_info["client_secret"], " ".join(OAUTH_SCOPES))
-        flow_info = flow.step1_get_device_and_user_codes()
-        print("Enter the following code at {0}: {1}".format(flow_info.verification_url,
-                                                            flow_info.user_code))
-        raw_input("Then press Enter/Return.")
-        try:
-            flags["credentials"] = flow.step2_exchange(device_flow_info=flow_info)
-        except:
-            print("Failed to get user credentials.")
+        flags["credentials"] = get_credentials(file_info)
+        if flags["credentials"] is None:
+            return
+
+    # ======
+    # Update loop
+    # ======
+    # Google client, worksheet and grader browser are kept across cycles and
+    # only rebuilt after a failure
+    session = new_session()
+    cycles = 0
+    cycles_time = 0
+    while True:
+        started = time.time()
+        if not update_cycle(input_file, file_info, flags, session):
+            return
+        cycles += 1
+        cycles_time += time.time()-started
+        if not flags["silent"]:
+            print("Cycle " + str(cycles) + " took " + ("%.3f" % (time.time()-started)) + "s (average " + ("%.3f" % (cycles_time/cycles)) + "s)")
+            print("Stages: " + session["metrics"].describe())
+
+        if flags["n"] == 0:
             return
+        flags["first"] = False
+        if flags["n"] > 0:
+            if flags["n"] < 2:
+                print(str(flags["n"])+" update remaining...")
+            else:
+                print(str(flags["n"])+" updates remaining...")
 
+        if time.time()-started < flags["l"]:
+            print("Next update: "+time.strftime("%d/%m/%Y %H:%M", time.localtime(started + flags["l"])))
+
+        while time.time()-started < flags["l"]:
+            time.sleep(min(1, flags["l"]-(time.time()-started)))
+        print("================")
+
+
+def new_session(client=None, google_lock=None, graders=None, name=None):
+    # name prefixes the messages of projects running side by side
+    return {
+        "name": name,
+        "client": client,
+        "worksheet": None,
+        "grader": None,
+        "shared_client": client,
+        "google_lock": google_lock or threading.Lock(),
+        "graders": graders,
+        "tick": 0
+    }
+
+
+def update_cycle(input_file, file_info, flags, session):
+    session["metrics"] = grader_metrics.CycleMetrics(input_file)
+    updated = run_cycle(input_file, file_info, flags, session)
+    session["metrics"].stop()
+    if flags["metrics"] is not None:
+        flags["metrics"].write(session["metrics"].record(updated))
+    return updated
+
+
+def run_cycle(input_file, file_info, flags, session):
+    metrics = session["metrics"]
+    retry = 0
+    started = time.mktime(time.localtime())
     while retry >= 0:
         if retry > 0:
-            print("================")
-            print("Failed to update results on " + time.strftime("%d/%m/%Y %H:%M", time.localtime()) + "... (in " + str(time.mktime(time.localtime()) - started) + "s)")
-            print("Retrying...")
-            print("================")
+            log(session["name"], "================")
+            log(session["name"], "Failed to update results on " + time.strftime("%d/%m/%Y %H:%M", time.localtime()) + "... (in " + str(time.mktime(time.localtime()) - started) + "s)")
+            log(session["name"], "Retrying...")
+            log(session["name"], "================")
+            session["client"] = session["shared_client"]
+            session["worksheet"] = None
+            session["grader"] = None
         retry = -1
         started = time.mktime(time.localtime())
+        metrics.attempts += 1
         # ======
         # Google Spreadsheet
         # ======
-        client = None
-
-        if not flags["silent"]:
-            print("Logging in...")
-        try:
-            client = gspread.authorize(flags["credentials"])
-        except gspread.AuthenticationError:
-            print("Invalid credentials.")
-            return
-        if not flags["silent"]:
-            print("Opening spreadsheets...")
-        try:
-            currentsheet = client.open_by_key(file_info["spreadsheet"])
-        except gspread.SpreadsheetNotFound:
-            print("Spreadsheet is not found")
-            return
-        if not flags["silent"]:
-            print("Opening worksheets...")
-        worksheets = currentsheet.worksheets()
-        workingsheet = None
-        for worksheet in worksheets:
-            if worksheet.title == file_info["worksheet"]:
-                workingsheet = worksheet
-                break
-        if workingsheet is None:
-            print("Worksheet \""+file_info["worksheet"]+"\" is not found")
-            if flags["autoretry"]:
-                retry = 1
-            continue
+        metrics.start("google")
+        if session["client"] is None:
+            if not flags["silent"]:
+                print("Logging in...")
+            try:
+                session["client"] = gspread.authorize(flags["credentials"], cache_size=SHEET_CACHE_SIZE, rate_limit=SHEET_RATE_LIMIT)
+            except gspread.AuthenticationError:
+                log(session["name"], "Invalid credentials.")
+                return False
+        elif flags["credentials"].access_token_expired:
+            try:
+                # Projects sharing the credential refresh it only once
+                with session["google_lock"]:
+                    if flags["credentials"].access_token_expired:
+                        if not flags["silent"]:
+                            print("Refreshing credentials...")
+                        session["client"].login()
+            except Exception as msg:
+                log(session["name"], "Google Error! "+str(msg))
+                if flags["autoretry"]:
+                    retry = 1
+                continue
+        client = session["client"]
+        metrics.watch(client.session)
+        if session["worksheet"] is None:
+            if not flags["silent"]:
+                print("Opening spreadsheets...")
+            try:
+                currentsheet = client.open_by_key(file_info["spreadsheet"])
+            except gspread.SpreadsheetNotFound:
+                log(session["name"], "Spreadsheet is not found")
+                return False
+            if not flags["silent"]:
+                print("Opening worksheets...")
+            worksheets = currentsheet.worksheets()
+            for worksheet in worksheets:
+                if worksheet.title == file_info["worksheet"]:
+                    session["worksheet"] = worksheet
+                    break
+            if session["worksheet"] is None:
+                log(session["name"], "Worksheet \""+file_info["worksheet"]+"\" is not found")
+                if flags["autoretry"]:
+                    retry = 1
+                continue
+        workingsheet = session["worksheet"]
         if flags["pause_google"]:
             raw_input("[Google] Press 'enter' or 'return' to continue...")
         if not flags["silent"]:
@@ -703,7 +901,13 @@ def update(mode="", input_file="", flags={}):
         # totalrow = 0
         exclude_cols = ["Total", "Passed", "Withdrawn"]
         exclude_rows = ["Total Score", "Mean", "Min", "Max", "Next Update"]
-        rows = workingsheet.get_all_values()
+        try:
+            rows = workingsheet.get_all_values()
+        except Exception as msg:
+            log(session["name"], "Google Error! "+str(msg))
+            if flags["autoretry"]:
+                retry = 1
+            continue
         selected_col = []
         selected_row = []
         if not flags["silent"]:
@@ -730,158 +934,151 @@ def update(mode="", input_file="", flags={}):
         # ======
         # Grader
         # ======
-        br = mechanize.Browser()
-        br.set_handle_robots(False)
+        metrics.start("grader")
+        if session["grader"] is None:
+            session["grader"] = grader_client.GraderSession(file_info["grader_user"], file_info["grader_password"])
+        grader = session["grader"]
+        br = grader.browser
         if flags["score"] is not None:
             if not flags["silent"]:
                 print("Gathering result from file...")
             result_file = open(flags["score"], "r")
-            result_html = BeautifulSoup(result_file.read())
+            result_page = result_file.read()
             result_file.close()
         else:
             if not flags["silent"]:
                 print("Gathering result from grader...")
-                print("Connecting to grader...")
-            try:
-                br.open(GRADER_BASE)
-            except Exception as msg:
-                print("Grader Error! "+str(msg))
-                if flags["autoretry"]:
-                    retry = 1
-                continue
-            if len(list(br.forms())) < 1:
-                print("No login form in grader... Please check the grader...")
-                if flags["autoretry"]:
-                    retry = 1
-                continue
-            br.form = list(br.forms())[0]
-            br.form["login"] = file_info["grader_user"]
-            br.form["password"] = file_info["grader_password"]
-            if not flags["silent"]:
-                print("Logging into grader...")
-            if re.search("Wrong password", br.submit().read()) is not None:
-                print("Invalid user or password.")
-                return
             if flags["pause_grader"]:
                 raw_input("[Grader] Press 'enter' or 'return' to continue...")
             if not flags["silent"]:
                 print("Browsing grader results...")
-            found = False
-            for link in br.links():
-                if link.url == "/user_admin/user_stat":
-                    found = True
-                    break
-            if not found:
-                print("Grader has no link to results page... Please check the grader...")
-                if flags["autoretry"]:
-                    retry = 1
-                continue
             try:
-                br.open(GRADER_BASE + "/user_admin/user_stat")
+                if session["graders"] is not None:
+                    # Requests and logins happen on the pool's session of the account
+                    result_page, requests, logins = session["graders"].open(file_info["grader_user"], file_info["grader_password"], "/user_admin/user_stat", session["tick"])
+                else:
+                    requests, logins = grader.requests, grader.logins
+                    result_page = grader.open("/user_admin/user_stat").read()
+                    requests, logins = grader.requests - requests, grader.logins - logins
+            except grader_client.LoginError:
+                log(session["name"], "Invalid user or password.")
+                return False
             except Exception as msg:
-                print("Grader Results Error! "+str(msg))
+                log(session["name"], "Grader Results Error! "+str(msg))
                 if flags["autoretry"]:
                     retry = 1
                 continue
+            if requests > 0:
+                metrics.add("grader", requests, len(result_page))
             if not flags["silent"]:
+                if logins > 0:
+                    print("Logged into grader...")
                 print("Collecting grader results...")
-            result_html = BeautifulSoup(br.response().read())
-        result_table_html = result_html.find("table", class_="info")
-        if result_table_html is None:
-            print("Grader results page has no table... Please check the grader...")
+        if not flags["silent"]:
+            print("Tabularize grader results...")
+        grader_rows = grader_client.extract_table(result_page)
+        if grader_rows is None:
+            log(session["name"], "Grader results page has no table... Please check the grader...")
             if flags["autoretry"]:
                 retry = 1
             continue
         if flags["store_source"]:
             result_file = open(time.strftime("Result_" + os.path.splitext(os.path.basename(input_file))[0] + "_%Y%m%d%H%M%S.html", time.localtime()), "w")
-            result_file.write(str(result_html))
+            result_file.write(result_page)
             result_file.close()
-        result_table = BeautifulSoup(str(result_table_html))
-        result_rows = result_table("tr")
-        grader_result = []
-        if not flags["silent"]:
-            print("Tabularize grader results...")
-        for result_row in result_rows:
-            result_cols = BeautifulSoup(str(result_row))
-            result_col = result_cols("td")
-            if len(result_col) <= 0:
-                result_col = result_cols("th")
-            orow = []
-            for col in result_col:
-                orow.append(trim(BeautifulSoup(str(col)).get_text()))
-            grader_result.append(str.join("\t", orow))
+        grader_result = [str.join("\t", row) for row in grader_rows]
         # ======
         # Merger
         # ======
+        metrics.start("merger")
         if not flags["silent"]:
             print("Connecting to merger...")
 
         try:
             br.open(UTILS_BASE+"/merger.php?api")
         except Exception as msg:
-            print("Merger Error! "+str(msg))
+            log(session["name"], "Merger Error! "+str(msg))
             if flags["autoretry"]:
                 retry = 1
             continue
 
         if len(list(br.forms())) < 1:
-            print("No submit form in merger...")
+            log(session["name"], "No submit form in merger...")
             if flags["autoretry"]:
                 retry = 1
             continue
         br.form = list(br.forms())[0]
-        br.form["source1"] = str.join("\n", old_sheet).encode("utf8")
-        br.form["source2"] = str.join("\n", grader_result).encode("utf8")
-        br.form["no_columns"] = file_info["merger_no_columns"]
-        br.form["no_rows"] = file_info["merger_no_rows"]
-        br.form["keep_columns"] = file_info["merger_keep_columns"]
-        br.form["keep_rows"] = file_info["merger_keep_rows"]
+        merger_fields = dict(zip(MERGER_FIELDS, [
+            str.join("\n", old_sheet).encode("utf8"),
+            str.join("\n", grader_result).encode("utf8"),
+            file_info["merger_no_columns"],
+            file_info["merger_no_rows"],
+            file_info["merger_keep_columns"],
+            file_info["merger_keep_rows"]
+        ]))
+        for field in MERGER_FIELDS:
+            br.form[field] = merger_fields[field]
         if flags["pause_merger"]:
             raw_input("[Merger] Press 'enter' or 'return' to continue...")
         if not flags["silent"]:
             print("Merging...")
-        merged_result = re.sub("<script.*$", "", br.submit().read())
+        merged_result = br.submit().read()
+        metrics.add("merger", 2, len(merger_fields["source1"]) + len(merger_fields["source2"]) + len(merged_result))
+        if flags["record"] is not None:
+            record_exchange(flags["record"], "merger", merger_fields, merged_result)
+        merged_result = api_result(merged_result)
         # ======
         # Normalizer
         # ======
+        metrics.start("normalizer")
         if not flags["silent"]:
             print("Connecting to normalizer...")
         try:
             br.open(UTILS_BASE+"/normalizer.php?api")
         except Exception as msg:
-            print("Normalizer Error! "+str(msg))
+            log(session["name"], "Normalizer Error! "+str(msg))
             if flags["autoretry"]:
                 retry = 1
             continue
         if len(list(br.forms())) < 1:
-            print("No submit form in normalizer...")
+            log(session["name"], "No submit form in normalizer...")
             if flags["autoretry"]:
                 retry = 1
             continue
         br.form = list(br.forms())[0]
-        br.form["source"] = merged_result
-        br.form["include_contests"] = file_info["normalizer_include_contests"]
-        br.form["calculate_columns"] = file_info["normalizer_calculate_columns"]
-        br.form["withdrawn_users"] = file_info["normalizer_withdrawn_users"]
-        br.form["exclude_users"] = file_info["normalizer_exclude_users"]
-        br.form["include_columns"] = file_info["normalizer_include_columns"]
-        br.form["datetime"] = time.strftime("%d/%m/%Y %H:%M", time.localtime())
+        normalizer_fields = dict(zip(NORMALIZER_FIELDS, [
+            merged_result,
+            file_info["normalizer_include_contests"],
+            file_info["normalizer_calculate_columns"],
+            file_info["normalizer_withdrawn_users"],
+            file_info["normalizer_exclude_users"],
+            file_info["normalizer_include_columns"],
+            time.strftime("%d/%m/%Y %H:%M", time.localtime())
+        ]))
+        for field in NORMALIZER_FIELDS:
+            br.form[field] = normalizer_fields[field]
         if flags["pause_normalizer"]:
             raw_input("[Normalizer] Press 'enter' or 'return' to continue...")
         if not flags["silent"]:
             print("Normalizing...")
-        normalized_result = trim(re.sub("<script.*$", "", br.submit().read()))
+        normalized_result = br.submit().read()
+        metrics.add("normalizer", 2, len(merged_result) + len(normalized_result))
+        if flags["record"] is not None:
+            record_exchange(flags["record"], "normalizer", normalizer_fields, normalized_result)
+        normalized_result = trim(api_result(normalized_result))
         if normalized_result.startswith("%error%"):
-            print("Normalization Alert! "+normalized_result[7:])
-            return
+            log(session["name"], "Normalization Alert! "+normalized_result[7:])
+            return False
         # ======
         # Update
         # ======
+        metrics.start("update")
+        metrics.watch(client.session)
         if not flags["silent"]:
             print("Converting results into list of lists...")
         normalized_result_list = normalized_result.split("\n")
         if len(normalized_result_list) < 1:
-            print("Normalized results appear to have an invalid data...")
+            log(session["name"], "Normalized results appear to have an invalid data...")
             if flags["autoretry"]:
                 retry = 1
             continue
@@ -895,48 +1092,169 @@ def update(mode="", input_file="", flags={}):
         else:
             result_list.append([None, None])
         if not flags["silent"]:
-            print("Gathering cells in worksheet...")
-        range_from = workingsheet.get_addr_int(1, 1)
-        range_to = workingsheet.get_addr_int(len(result_list), len(result_list[0]))
-        if not flags["silent"]:
-            print("From "+range_from+" to "+range_to+"...")
-        result_cells = workingsheet.range(range_from+":"+range_to)
-        for cell in result_cells:
-            colnum = cell.col-1
-            rownum = cell.row-1
-            if rownum < len(result_list) and colnum < len(result_list[rownum]):
-                if result_list[rownum][colnum] is None:
-                    cell.value = ""
-                elif trim(result_list[rownum][colnum]) != "":
-                    cell.value = result_list[rownum][colnum].decode("utf8")
+            print("Comparing results with worksheet...")
+        # Changed cells are written without reading them back first
+        changed_cells = diff_cells(rows, result_list)
         if flags["pause_update"]:
             raw_input("[Update] Press 'enter' or 'return' to continue...")
-        if not flags["silent"]:
-            print("Updating results...")
-        workingsheet.update_cells(result_cells)
+        if len(changed_cells) > 0:
+            if not flags["silent"]:
+                print("Updating " + str(len(changed_cells)) + " changed cell(s)...")
+            try:
+                workingsheet.update_values(changed_cells)
+            except Exception as msg:
+                log(session["name"], "Google Error! "+str(msg))
+                # The worksheet is reopened by the next attempt or cycle
+                session["client"] = session["shared_client"]
+                session["worksheet"] = None
+                if flags["autoretry"]:
+                    retry = 1
+                continue
+        elif not flags["silent"]:
+            print("No changes in results...")
         if not flags["silent"]:
             print("================")
             print("Results has been updated successfully on "+time.strftime("%d/%m/%Y %H:%M", time.localtime())+"... (in "+str(time.mktime(time.localtime())-started)+"s)")
+        return True
+    return False
 
-        if flags["n"] < 0 or flags["n"] > 0:
-            flags["first"] = False
-            if flags["n"] > 0:
-                if flags["n"] < 2:
-                    print(str(flags["n"])+" update remaining...")
-                else:
-                    print(str(flags["n"])+" updates remaining...")
 
-            timeremain = time.mktime(time.localtime())-started
-            if timeremain < flags["l"]:
-                print("Next update: "+time.strftime("%d/%m/%Y %H:%M", time.localtime(time.mktime(time.localtime()) + flags["l"])))
+def schedule_worker(due, finished):
+    while True:
+        project = due.get()
+        started = time.time()
+        try:
+            updated = update_cycle(project["file"], project["info"], project["flags"], project["session"])
+        except Exception as msg:
+            log(project["file"], "Unexpected error! " + str(msg))
+            updated = False
+        finished.put((project, updated, started, time.time()))
+
 
-            while time.mktime(time.localtime())-started < flags["l"]:
-                time.sleep(1)
-            print("================")
-            update(mode, input_file, flags)
+def schedule(input_files, flags):
+    projects = []
+    for input_file in input_files:
+        delay = flags["l"]
+        if "@" in input_file:
+            argument = input_file
+            input_file, delay = input_file.rsplit("@", 1)
+            if not delay.isdigit() or int(delay) < 1:
+                print("Invalid delay in \"" + argument + "\", expected <project_file>@<seconds>")
+                return
+            delay = int(delay)
+        file_info = load_project(input_file)
+        if file_info is None:
+            print("Cannot load project " + input_file)
             return
-        # print("Results update successfully...")
-    return
+        project_flags = dict(flags)
+        project_flags["l"] = delay
+        # Cycles run side by side, only errors and cycle summaries are printed
+        project_flags["silent"] = True
+        for breakpoint in grader_metrics.STAGES:
+            project_flags["pause_" + breakpoint] = False
+        projects.append({
+            "file": input_file,
+            "info": file_info,
+            "flags": project_flags,
+            "next": time.time(),
+            "running": False,
+            "done": False,
+            "cycles": 0,
+            "cycles_time": 0
+        })
+    if len(projects) < 1:
+        print("No project to schedule")
+        return
+
+    if not flags["silent"]:
+        print("==== Projects ====")
+        for project in projects:
+            print(project["file"] + ": " + project["info"]["spreadsheet"] + " / " + project["info"]["worksheet"] + " as " + project["info"]["grader_user"] + " every " + str(project["flags"]["l"]) + "s")
+        print("================")
+        if not flags["force"]:
+            confirm = raw_input("Continue? (type 'n' or 'cancel' to cancel): ")
+            if confirm.lower() == "n" or confirm.lower() == "cancel":
+                return
+
+    # Projects authorized with the same credential share its Google client,
+    # projects of the same grader account share its grader session
+    authorized = []
+    clients = {}
+    graders = grader_client.GraderPool()
+    for project in projects:
+        credential = None
+        for other in authorized:
+            if (other["info"]["client_id"], other["info"]["client_secret"]) != (project["info"]["client_id"], project["info"]["client_secret"]):
+                continue
+            confirm = raw_input("Use the account authorized for " + other["file"] + " on " + project["file"] + "? (type 'y' or 'yes' to share): ")
+            if confirm.lower() == "y" or confirm.lower() == "yes":
+                credential = other["flags"]["credentials"]
+                break
+        if credential is None:
+            if not flags["silent"]:
+                print("Getting user credential for " + project["file"] + "...")
+            credential = get_credentials(project["info"])
+            if credential is None:
+                return
+            authorized.append(project)
+        project["flags"]["credentials"] = credential
+        key = gspread.ratelimit.credential_key(credential)
+        if key not in clients:
+            try:
+                client = gspread.authorize(credential, cache_size=SHEET_CACHE_SIZE, rate_limit=SHEET_RATE_LIMIT)
+            except gspread.AuthenticationError:
+                print("Invalid credentials.")
+                return
+            clients[key] = (client, threading.Lock())
+        client, google_lock = clients[key]
+        project["session"] = new_session(client, google_lock, graders, project["file"])
+
+    due = queue.Queue()
+    finished = queue.Queue()
+    for i in range(min(flags["workers"], len(projects))):
+        thread = threading.Thread(target=schedule_worker, args=(due, finished))
+        thread.daemon = True
+        thread.start()
+
+    tick = 0
+    while True:
+        ready = [project for project in projects if not project["running"] and not project["done"] and project["next"] <= time.time()]
+        if len(ready) > 0:
+            tick += 1
+            for project in ready:
+                project["running"] = True
+                project["session"]["tick"] = tick
+                due.put(project)
+        if len([project for project in projects if project["running"] or not project["done"]]) < 1:
+            break
+        deadline = time.time() + flags["tick"]
+        while time.time() < deadline:
+            try:
+                project, updated, started, ended = finished.get(True, deadline - time.time())
+            except queue.Empty:
+                break
+            project["running"] = False
+            if not updated:
+                project["done"] = True
+                log(project["file"], "Stopped after a failed update")
+                continue
+            project["cycles"] += 1
+            project["cycles_time"] += ended-started
+            log(project["file"], "Cycle " + str(project["cycles"]) + " took " + ("%.3f" % (ended-started)) + "s (average " + ("%.3f" % (project["cycles_time"]/project["cycles"])) + "s)")
+            if not flags["silent"]:
+                log(project["file"], "Stages: " + project["session"]["metrics"].describe())
+            if project["flags"]["n"] == 0:
+                project["done"] = True
+                continue
+            project["next"] = started + project["flags"]["l"] + random.uniform(0, flags["jitter"])
+            if not flags["silent"]:
+                log(project["file"], "Next update: " + time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(project["next"])))
+    if not flags["silent"]:
+        log(None, "Grader pages fetched " + str(graders.fetches) + " time(s), shared " + str(graders.reuses) + " time(s)")
+        for client, google_lock in clients.values():
+            stats = client.session.rate_limiter.stats()
+            log(None, "Sheets requests: " + str(stats["requests"]) + ", delayed " + str(stats["delayed"]) + " (" + ("%.1f" % stats["wait_time"]) + "s), throttled " + str(stats["throttled"]) + ", retried " + str(stats["retries"]) + ", failed " + str(stats["failures"]))
+
 
 if __name__ == "__main__":
     run(sys.argv)
@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+import mechanize
+from bs4 import BeautifulSoup, SoupStrainer
+
+GRADER_BASE = "http://grader.eng.src.ku.ac.th"
+COOKIE_DIR = os.path.join(os.path.expanduser("~"), ".grader")
+
+
+def row_cells(row):
+    # Cells anywhere in a table row, header cells for rows without data cells
+    cells = row.find_all("td")
+    if len(cells) < 1:
+        cells = row.find_all("th")
+    return cells
+
+
+def table_rows(table):
+    for row in table.find_all("tr"):
+        yield row_cells(row)
+
+
+def extract_table(markup, class_="info"):
+    # Text of every cell of the first table with the given class, or None.
+    # Only the table itself is parsed out of the page.
+    page = BeautifulSoup(markup, parse_only=SoupStrainer("table", class_=class_))
+    table = page.find("table")
+    if table is None:
+        return None
+    return [[cell.get_text().strip(" \n\t") for cell in cells] for cells in table_rows(table)]
+
+
+class GraderError(Exception):
+    pass
+
+
+class LoginError(GraderError):
+    pass
+
+
+class GraderSession(object):
+    # A logged-in grader browser. Cookies are optionally persisted to disk so
+    # later cycles and runs can skip the login form until the session expires.
+    def __init__(self, username, password, cookie_file="", base=""):
+        self.username = username
+        self.password = password
+        if base == "":
+            base = GRADER_BASE
+        self.base = base
+        if cookie_file == "":
+            cookie_file = os.path.join(COOKIE_DIR, re.sub("[^\\w.-]", "_", username) + ".cookies")
+        self.cookie_file = cookie_file
+        self.cookiejar = mechanize.LWPCookieJar()
+        if cookie_file is not None and os.path.exists(cookie_file):
+            try:
+                self.cookiejar.load(cookie_file, ignore_discard=True)
+            except Exception:
+                self.cookiejar.clear()
+        self.browser = mechanize.Browser()
+        self.browser.set_handle_robots(False)
+        self.browser.set_cookiejar(self.cookiejar)
+        # Downloads only share the browser's cookies. Its equiv and history
+        # handling keep a seekable in-memory copy of every response body.
+        self.downloader = mechanize.build_opener(mechanize.HTTPCookieProcessor(self.cookiejar))
+        # Every request sent to the grader, logins and refetches included
+        self.requests = 0
+        self.logins = 0
+
+    def save(self):
+        if self.cookie_file is None:
+            return
+        cookie_dir = os.path.dirname(self.cookie_file)
+        if cookie_dir != "" and not os.path.exists(cookie_dir):
+            os.makedirs(cookie_dir, 0o700)
+        self.cookiejar.save(self.cookie_file, ignore_discard=True)
+        os.chmod(self.cookie_file, 0o600)
+
+    def is_expired(self):
+        # Grader sends us back to the login form once the session is gone
+        if not self.browser.viewing_html():
+            return False
+        for form in self.browser.forms():
+            try:
+                form.find_control("password")
+                return True
+            except mechanize.ControlNotFoundError:
+                continue
+        return False
+
+    def login(self):
+        self.cookiejar.clear()
+        self.requests += 1
+        self.browser.open(self.base)
+        if len(list(self.browser.forms())) < 1:
+            raise GraderError("No login form in grader... Please check the grader...")
+        self.browser.form = list(self.browser.forms())[0]
+        self.browser.form["login"] = self.username
+        self.browser.form["password"] = self.password
+        self.requests += 1
+        response = self.browser.submit()
+        if re.search("Wrong password", response.read()) is not None:
+            raise LoginError("Wrong password")
+        response.seek(0)
+        self.logins += 1
+        self.save()
+        return response
+
+    def request(self, path, headers=None):
+        return mechanize.Request(self.base + path, headers=headers or {})
+
+    def open(self, path, headers=None):
+        if len(self.cookiejar) == 0:
+            self.login()
+        self.requests += 1
+        response = self.browser.open(self.request(path, headers))
+        if self.is_expired():
+            self.login()
+            self.requests += 1
+            response = self.browser.open(self.request(path, headers))
+            if self.is_expired():
+                raise GraderError("Grader session could not be established")
+        self.save()
+        return response
+
+    def stream(self, path, headers=None):
+        # For downloads that are read once in chunks, the body is never held
+        # in memory as a whole
+        if len(self.cookiejar) == 0:
+            self.login()
+        self.requests += 1
+        return self.downloader.open(self.request(path, headers))
+
+
+class GraderPool(object):
+    # Grader sessions shared by every project using the same account. A page
+    # is fetched once per account and scheduler tick, later requests in the
+    # same tick get the copy. Returns the page, how many requests the
+    # account's session sent for it (none for a copy) and how many times it
+    # logged in to fetch it.
+    def __init__(self, base=""):
+        if base == "":
+            base = GRADER_BASE
+        self.base = base
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.fetches = 0
+        self.reuses = 0
+
+    def account(self, username, password):
+        with self.lock:
+            account = self.accounts.get((username, password))
+            if account is None:
+                account = {
+                    "session": GraderSession(username, password, base=self.base),
+                    "lock": threading.Lock(),
+                    "pages": {}
+                }
+                self.accounts[(username, password)] = account
+            return account
+
+    def open(self, username, password, path, tick):
+        account = self.account(username, password)
+        with account["lock"]:
+            page = account["pages"].get(path)
+            if page is not None and page[0] == tick:
+                with self.lock:
+                    self.reuses += 1
+                return (page[1], 0, 0)
+            requests = account["session"].requests
+            logins = account["session"].logins
+            content = account["session"].open(path).read()
+            account["pages"][path] = (tick, content)
+            with self.lock:
+                self.fetches += 1
+            return (content, account["session"].requests - requests, account["session"].logins - logins)
@@ -3,10 +3,10 @@ import os
 import re
 import sys
 import time
+import random
 import threading
 import traceback
 import gspread
-import mechanize
 import argparse
 try:
     import readline
@@ -14,8 +14,9 @@ try:
 except ImportError:
     pass
 from bs4 import BeautifulSoup
+import grader_client
 
-GRADER_BASE = "http://grader.eng.src.ku.ac.th"
+GRADER_BASE = grader_client.GRADER_BASE
 
 GOOGLE_EMAIL = ""
 GOOGLE_PASSWORD = ""
@@ -25,6 +26,14 @@ LOG_WORKSHEET = "Logs"
 
 SUBMISSION_PROBLEM_ID = "submission_problem_id"
 
+LOG_HEADERS = ["User", "Number of Logins", "Last Login", "Remark", "Command", "Command Response"]
+POLL_DELAY = 5
+MAX_POLL_DELAY = 30
+POLL_BACKOFF = 1.5
+POLL_JITTER = 0.2
+SHEET_CACHE_SIZE = 16
+SHEET_RATE_LIMIT = 2
+
 
 class LogThread(threading.Thread):
     def __init__(self, logsheet, adminOptions, username, browser):
@@ -34,7 +43,8 @@ class LogThread(threading.Thread):
         self.browser = browser
         self.problems = None
         self.acceptPattern = None
-        self.delay = 5
+        self.row = None
+        self.delay = POLL_DELAY
         threading.Thread.__init__(self)
         self.running = False
         self.quit = False
@@ -50,19 +60,23 @@ class LogThread(threading.Thread):
     def isQuit(self):
         return self.quit
 
-    def remark(self, remark):
-        found = False
-        selectedRow = 1
-        for value in self.logsheet.col_values(1):
-            if value == self.username:
-                found = True
-                break
+    def findRow(self):
+        # Row of this user in the log sheet (or the first empty one), looked
+        # up once per session
+        if self.row is not None:
+            return self.row
+        users = self.logsheet.get_all_values(min_row=2, min_col=1, max_col=1, sparse=True)
+        selectedRow = 2
+        while (selectedRow, 1) in users and users[(selectedRow, 1)] != self.username:
             selectedRow += 1
+        self.row = selectedRow
+        return self.row
 
-        if not found:
+    def remark(self, remark):
+        if self.row is None:
             return
 
-        cell = self.logsheet.cell(selectedRow, 4)
+        cell = self.logsheet.cell(self.row, 4)
         cell.value = remark
         self.logsheet.update_cells([cell])
 
@@ -73,134 +87,98 @@ class LogThread(threading.Thread):
             self.remark(self.adminOptions.remark)
 
     def logout(self):
-        found = False
-        selectedRow = 1
-        for value in self.logsheet.col_values(1):
-            if value == self.username:
-                found = True
-                break
-            selectedRow += 1
-
-        if not found:
+        if self.row is None:
+            self.running = False
             return
 
-        cell = self.logsheet.cell(selectedRow, 4)
+        cell = self.logsheet.cell(self.row, 4)
         cell.value = "Logout on " + time.strftime("%d/%m/%Y %H:%M:%S", time.localtime())
         self.logsheet.update_cells([cell])
         self.running = False
 
+    def register(self):
+        selectedRow = self.findRow()
+        cells = self.logsheet.range(self.logsheet.get_addr_int(1, 1)+":"+self.logsheet.get_addr_int(1, len(LOG_HEADERS)))
+        if selectedRow > 1:
+            cells += self.logsheet.range(self.logsheet.get_addr_int(selectedRow, 1)+":"+self.logsheet.get_addr_int(selectedRow, len(LOG_HEADERS)))
+
+        changedCells = []
+        infoText = ""
+        for cell in cells:
+            oldValue = cell.value
+            if cell.row == 1:
+                cell.value = LOG_HEADERS[cell.col-1]
+            elif cell.row == selectedRow:
+                if cell.col == 1 and cell.value == "":
+                    cell.value = self.username
+                elif cell.col == 2:
+                    if oldValue == "":
+                        cell.value = "1"
+                    elif parsable(oldValue):
+                        cell.value = str(int(oldValue)+1)
+                    else:
+                        infoText = "Invalid: " + cell.value
+                        cell.value = "1"
+                elif cell.col == 3:
+                    cell.value = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime())
+                elif cell.col == 4:
+                    cell.value = infoText
+            if cell.value != oldValue:
+                changedCells.append(cell)
+        if len(changedCells) > 0:
+            self.logsheet.update_cells(changedCells)
+
     def command(self):
-        started = time.mktime(time.localtime())
+        # Polls only the command cell. The interval backs off while no
+        # command arrives and resets after one is executed.
         while self.running:
+            started = time.time()
             try:
-                found = False
-                selectedRow = 1
-                for value in self.logsheet.col_values(1):
-                    if value == self.username:
-                        found = True
-                        break
-                    selectedRow += 1
-
-                if not found:
-                    continue
-
-                range_from = self.logsheet.get_addr_int(selectedRow, 1)
-                range_to = self.logsheet.get_addr_int(selectedRow, 6)
-                cells = self.logsheet.range(range_from+":"+range_to)
-
-                commandResponse = ""
-                for cell in cells:
-                    if cell.col == 5:
-                        command = re.sub(";.*", "", cell.value)
-                        if command == "":
-                            break
-                        if self.problems is None or self.acceptPattern is None:
-                            commandResponse = "Command is not ready"
-                            continue
-                        if command.startswith("os "):
-                            commandResponse = trim(os.popen(command[3:]).read())
-                        elif command.startswith("bg "):
-                            commandResponse = run_command(command[3:], self.browser, self.problems, self.acceptPattern, background=True)
-                        else:
-                            run_command(command, self.browser, self.problems, self.acceptPattern, background=False)
-                            printProblems(self.problems, self.username, background=True)
-                            commandResponse = "Run as foreground"
-                        if commandResponse is None:
-                            self.running = False
-                            self.quit = True
-                            commandResponse = "Logout"
-                        elif type(commandResponse) is bool and not commandResponse:
-                            commandResponse = "Invalid command."
-                        cell.value = ";Run on " + time.strftime("%d/%m/%Y %H:%M:%S", time.localtime())
-                    elif cell.col == 6:
-                        cell.value = commandResponse.replace("=", "-")
-                self.logsheet.update_cells(cells)
-                while time.mktime(time.localtime())-started < self.delay:
-                    time.sleep(1)
-                started = time.mktime(time.localtime())
+                commandCell = self.logsheet.cell(self.findRow(), 5)
+                command = re.sub(";.*", "", commandCell.value)
+                # Commands are kept until the problem list is ready
+                if command == "" or self.problems is None or self.acceptPattern is None:
+                    self.delay = min(self.delay * POLL_BACKOFF, MAX_POLL_DELAY)
+                else:
+                    self.delay = POLL_DELAY
+                    if command.startswith("os "):
+                        commandResponse = trim(os.popen(command[3:]).read())
+                    elif command.startswith("bg "):
+                        commandResponse = run_command(command[3:], self.browser, self.problems, self.acceptPattern, background=True)
+                    else:
+                        run_command(command, self.browser, self.problems, self.acceptPattern, background=False)
+                        printProblems(self.problems, self.username, background=True)
+                        commandResponse = "Run as foreground"
+                    if commandResponse is None:
+                        self.running = False
+                        self.quit = True
+                        commandResponse = "Logout"
+                    elif type(commandResponse) is bool and not commandResponse:
+                        commandResponse = "Invalid command."
+                    commandCell.value = ";Run on " + time.strftime("%d/%m/%Y %H:%M:%S", time.localtime())
+                    responseCell = self.logsheet.cell(self.row, 6)
+                    responseCell.value = commandResponse.replace("=", "-")
+                    self.logsheet.update_cells([commandCell, responseCell])
             except (KeyboardInterrupt, SystemExit):
                 self.running = False
                 return
             except Exception:
-                continue
+                pass
+            delay = self.delay * (1 + random.random() * POLL_JITTER)
+            while self.running and time.time()-started < delay:
+                time.sleep(min(1, delay-(time.time()-started)))
 
     def run(self):
         self.running = True
         while self.running:
             try:
-                selectedRow = 1
-                for value in self.logsheet.col_values(1):
-                    if selectedRow == 1:
-                        selectedRow += 1
-                        continue
-                    if value == "" or value == self.username:
-                        break
-                    selectedRow += 1
-
-                if selectedRow == 1:
-                    selectedRow = 2
-                range_from = self.logsheet.get_addr_int(1, 1)
-                range_to = self.logsheet.get_addr_int(selectedRow, 6)
-                cells = self.logsheet.range(range_from+":"+range_to)
-
-                infoText = ""
-                for cell in cells:
-                    if cell.row == 1:
-                        if cell.col == 1:
-                            cell.value = "User"
-                        elif cell.col == 2:
-                            cell.value = "Number of Logins"
-                        elif cell.col == 3:
-                            cell.value = "Last Login"
-                        elif cell.col == 4:
-                            cell.value = "Remark"
-                        elif cell.col == 5:
-                            cell.value = "Command"
-                        elif cell.col == 6:
-                            cell.value = "Command Response"
-                    elif cell.row == selectedRow:
-                        if cell.col == 1 and cell.value == "":
-                            cell.value = self.username
-                        elif cell.col == 2:
-                            oldValue = cell.value
-                            if oldValue == "":
-                                cell.value = "1"
-                            elif parsable(oldValue):
-                                cell.value = str(int(oldValue)+1)
-                            else:
-                                infoText = "Invalid: " + cell.value
-                                cell.value = "1"
-                        elif cell.col == 3:
-                            cell.value = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime())
-                        elif cell.col == 4:
-                            cell.value = infoText
-                    elif cell.row > selectedRow:
-                        break
-                self.logsheet.update_cells(cells)
+                self.register()
             except (KeyboardInterrupt, SystemExit):
                 self.running = False
                 return
             except Exception:
+                self.row = None
+                time.sleep(1)
                 continue
             self.adminCommand()
             self.command()
@@ -433,7 +411,7 @@ def subrun(options):
         else:
             print("Please wait...")
         try:
-            client = gspread.login(GOOGLE_EMAIL, GOOGLE_PASSWORD)
+            client = gspread.login(GOOGLE_EMAIL, GOOGLE_PASSWORD, cache_size=SHEET_CACHE_SIZE, rate_limit=SHEET_RATE_LIMIT)
         except gspread.AuthenticationError, e:
             if options.verbose:
                 print("Invalid email or password.")
@@ -553,35 +531,32 @@ def subrun(options):
                     print("User not found. Press 'Enter' to exit (without typing anything).")
                 return {"return": True}
 
-            br = mechanize.Browser()
-            br.set_handle_robots(False)
+            # Exam machines are shared, so the session is never written to disk
+            grader = grader_client.GraderSession(options.username, userPassword, cookie_file=None)
+            print("Logging into grader...")
             try:
-                br.open(GRADER_BASE)
+                grader.login()
+            except grader_client.LoginError:
+                print("Wrong password")
+                continue
+            except grader_client.GraderError as msg:
+                print(str(msg))
+                return {"return": False}
             except Exception as msg:
                 print("Grader Error! "+str(msg))
                 traceback.print_exc()
                 return {"return": False}
-            if len(list(br.forms())) < 1:
-                print("No login form in grader... Please check the grader...")
-                return {"return": False}
-            br.form = list(br.forms())[0]
-            br.form["login"] = options.username
-            br.form["password"] = userPassword
-            print("Logging into grader...")
-            if re.search("Wrong password", br.submit().read()) is not None:
-                print("Wrong password")
-                continue
+            br = grader.browser
             break
         logThread = LogThread(logsheet, adminOptions, options.username, br)
         clear()
         while True:
             try:
-                br.open(GRADER_BASE+"/main/list")
+                grader_page = BeautifulSoup(grader.open("/main/list").read())
             except Exception as msg:
                 print("Grader Error! "+str(msg))
                 traceback.print_exc()
                 continue
-            grader_page = BeautifulSoup(br.response().read())
             submission = grader_page.find("select", id=SUBMISSION_PROBLEM_ID)
             problems = submission.find_all("option")
             problems_list = []
@@ -591,18 +566,18 @@ def subrun(options):
                 problems_list.append({"id": int(problem["value"]), "name": problem.string})
 
             problems_dict = {}
-            infoTables = grader_page.find_all("table")
+            infoTables = grader_page.find_all("table", class_="info")
             for table in infoTables:
-                if "class" not in table.attrs:
-                    continue
-                elif "info" not in table.attrs["class"]:
-                    continue
                 for row in table.find_all("tr"):
-                    if "info-head" in row.attrs["class"]:
+                    # Header rows are marked info-head, whatever their cells
+                    if "info-head" in (row.get("class") or []):
+                        continue
+                    cells = grader_client.row_cells(row)
+                    if len(cells) < 1 or cells[0].name == "th":
                         continue
                     problem = {"name": "", "description": None, "status": "", "compiler_msg": None}
                     cellNumber = 0
-                    for cell in row.find_all("td"):
+                    for cell in cells:
                         if cellNumber == 1:
                             problemName = ""
                             for child in cell.children:
@@ -0,0 +1,150 @@
+import csv
+import json
+import math
+import os
+import threading
+import time
+import timeit
+from collections import OrderedDict
+
+# Stages of an update cycle, named as the -break breakpoints
+STAGES = ["google", "grader", "merger", "normalizer", "update"]
+
+timer = timeit.default_timer
+
+
+def http_counters(http_session):
+    if http_session is None:
+        return (0, 0)
+    # Only the calling thread's traffic, a session may be shared by projects
+    requests, sent, received = http_session.thread_counters()
+    return (requests, sent + received)
+
+
+class CycleMetrics(object):
+    # Wall time, requests and bytes of every stage of one update cycle,
+    # retries included
+    def __init__(self, project):
+        self.project = project
+        self.started = timer()
+        self.ended = None
+        self.attempts = 0
+        self.times = OrderedDict((stage, 0.0) for stage in STAGES)
+        self.requests = OrderedDict((stage, 0) for stage in STAGES)
+        self.bytes = OrderedDict((stage, 0) for stage in STAGES)
+        self.stage = None
+        self.stage_started = None
+        self.http = None
+        self.http_base = (0, 0)
+
+    def start(self, stage):
+        self.stop()
+        self.stage = stage
+        self.stage_started = timer()
+
+    def watch(self, http_session):
+        # Counts the requests this thread sends on an HTTP session towards
+        # the current stage, other projects sharing the session are not
+        # counted.
+        self.http = http_session
+        self.http_base = http_counters(http_session)
+
+    def add(self, stage, requests=0, size=0):
+        self.requests[stage] += requests
+        self.bytes[stage] += size
+
+    def stop(self):
+        if self.stage is None:
+            return
+        self.times[self.stage] += timer()-self.stage_started
+        if self.http is not None:
+            requests, size = http_counters(self.http)
+            self.add(self.stage, requests-self.http_base[0], size-self.http_base[1])
+        self.stage = None
+        self.http = None
+
+    def describe(self):
+        return str.join(", ", ["%s %.3fms" % (stage, self.times[stage] * 1000) for stage in STAGES])
+
+    def record(self, ok):
+        self.stop()
+        if self.ended is None:
+            self.ended = timer()
+        record = OrderedDict()
+        record["time"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+        record["project"] = self.project
+        record["ok"] = 1 if ok else 0
+        record["attempts"] = self.attempts
+        record["total_ms"] = round((self.ended-self.started) * 1000, 3)
+        for stage in STAGES:
+            record[stage + "_ms"] = round(self.times[stage] * 1000, 3)
+            record[stage + "_requests"] = self.requests[stage]
+            record[stage + "_bytes"] = self.bytes[stage]
+        return record
+
+
+class MetricsLog(object):
+    # Appends cycle records to a CSV file (*.csv) or a JSON lines file
+    def __init__(self, path):
+        self.path = path
+        self.csv = path.lower().endswith(".csv")
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            f = open(self.path, "a")
+            if self.csv:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(list(record.keys()))
+                writer.writerow(list(record.values()))
+            else:
+                f.write(json.dumps(record) + "\n")
+            f.close()
+
+
+def load(path):
+    records = []
+    f = open(path, "r")
+    if path.lower().endswith(".csv"):
+        for row in csv.DictReader(f):
+            records.append(row)
+    else:
+        for line in f:
+            if line.strip() != "":
+                records.append(json.loads(line))
+    f.close()
+    return records
+
+
+def percentile(values, percent):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(len(ordered)-1, rank))]
+
+
+def summarize(records):
+    # Lines of a p50/p95 report per project and over all projects
+    groups = OrderedDict()
+    groups["All projects"] = records
+    for record in records:
+        groups.setdefault(record["project"], []).append(record)
+    if len(groups) == 2:
+        del groups["All projects"]
+    lines = []
+    for name, group in groups.items():
+        ok = len([record for record in group if int(record["ok"]) == 1])
+        lines.append("%s: %d cycle(s), %d failed" % (name, len(group), len(group)-ok))
+        lines.append("  %-10s %10s %10s %10s %12s" % ("stage", "p50 ms", "p95 ms", "req/cycle", "bytes/cycle"))
+        for stage in STAGES + ["total"]:
+            times = [float(record[stage + "_ms"]) for record in group]
+            if stage == "total":
+                requests = sum(float(record[s + "_requests"]) for record in group for s in STAGES)
+                size = sum(float(record[s + "_bytes"]) for record in group for s in STAGES)
+            else:
+                requests = sum(float(record[stage + "_requests"]) for record in group)
+                size = sum(float(record[stage + "_bytes"]) for record in group)
+            lines.append("  %-10s %10.3f %10.3f %10.1f %12.0f" % (stage, percentile(times, 50), percentile(times, 95), requests / len(group), size / len(group)))
+    return lines
@@ -19,7 +19,8 @@ except ImportError:
 
 
 from .client import Client, login, authorize
-from .models import Spreadsheet, Worksheet, Cell
+from .models import Spreadsheet, Worksheet, Cell, RowWriter
+from .parallel import ConcurrentClient
 from .exceptions import (GSpreadException, AuthenticationError,
                          SpreadsheetNotFound, NoValidUrlKeyFound,
                          IncorrectCellLabel, WorksheetNotFound,
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+gspread.cache
+~~~~~~~~~~~~~
+
+This module contains a cache for feeds revalidated with ETags.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FeedCache(object):
+
+    """Keeps parsed feeds by URL together with the ETag they were served
+       with, evicting the least recently used ones.
+
+       :param max_entries: Maximum number of feeds kept.
+
+       A hit is a feed reused after the server answered
+       `304 Not Modified`, a miss is a feed that had to be downloaded.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def etag(self, url):
+        """Returns the ETag of the cached feed for `url` or `None`."""
+        with self._lock:
+            entry = self._entries.get(url)
+            return entry[0] if entry is not None else None
+
+    def hit(self, url):
+        """Returns the cached feed for `url` after a `304 Not Modified`,
+           or `None` if it has been evicted in the meantime.
+        """
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is None:
+                return None
+            self._entries[url] = entry
+            self.hits += 1
+            return entry[1]
+
+    def miss(self, url, etag, value):
+        """Stores a freshly downloaded feed. Feeds without an ETag are
+           not kept.
+        """
+        with self._lock:
+            self.misses += 1
+            self._entries.pop(url, None)
+            if etag is None:
+                return
+            self._entries[url] = (etag, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forgets all cached feeds. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
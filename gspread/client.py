@@ -9,6 +9,7 @@ Google Data API.
 
 """
 import re
+import time
 import warnings
 
 from xml.etree import ElementTree
@@ -17,9 +18,10 @@ from . import __version__
 from . import urlencode
 from .ns import _ns
 from .httpsession import HTTPSession, HTTPError
+from .cache import FeedCache
+from .ratelimit import shared_limiter
 from .models import Spreadsheet
 from .urls import construct_url
-from .utils import finditem
 from .exceptions import (AuthenticationError, SpreadsheetNotFound,
                          NoValidUrlKeyFound, UpdateCellError,
                          RequestError)
@@ -41,6 +43,15 @@ class Client(object):
                  oauth2client library. https://github.com/google/oauth2client
     :param http_session: (optional) A session object capable of making HTTP requests while persisting headers.
                                     Defaults to :class:`~gspread.httpsession.HTTPSession`.
+    :param cache_size: (optional) Number of cell feeds to keep in a :class:`~gspread.cache.FeedCache`.
+                                  Cached feeds are revalidated with their ETag and reused while unchanged.
+                                  Caching is off by default.
+    :param metadata_ttl: (optional) Seconds spreadsheets opened by key and their worksheet lists are reused
+                                    before being fetched again. By default spreadsheets are fetched on every
+                                    open and worksheet lists are kept for the life of the spreadsheet object.
+    :param rate_limit: (optional) Requests per second allowed for the credential in `auth`. The limit is shared
+                                  with every other client using the same credential, and throttled requests
+                                  are retried with backoff. See :class:`~gspread.ratelimit.RateLimiter`.
 
     >>> c = gspread.Client(auth=('user@example.com', 'qwertypassword'))
 
@@ -50,9 +61,17 @@ class Client(object):
 
 
     """
-    def __init__(self, auth, http_session=None):
+    def __init__(self, auth, http_session=None, cache_size=0, metadata_ttl=None,
+                 rate_limit=None):
         self.auth = auth
         self.session = http_session or HTTPSession()
+        if rate_limit:
+            self.session.rate_limiter = shared_limiter(
+                auth, rate=rate_limit, burst=max(1, int(rate_limit * 2)))
+        self.cache = FeedCache(cache_size) if cache_size else None
+        self.metadata_ttl = metadata_ttl
+        # key -> (opened at, Spreadsheet)
+        self._spreadsheets = {}
 
     def _get_auth_token(self, content):
         for line in content.splitlines():
@@ -162,20 +181,25 @@ class Client(object):
         >>> c.open_by_key('0BmgG6nO_6dprdS1MN3d3MkdPa142WFRrdnRRUWl1UFE')
 
         """
-        feed = self.get_spreadsheets_feed()
-        for elem in feed.findall(_ns('entry')):
-            alter_link = finditem(lambda x: x.get('rel') == 'alternate',
-                                  elem.findall(_ns('link')))
-            m = _url_key_re_v1.search(alter_link.get('href'))
-            if m and m.group(1) == key:
-                return Spreadsheet(self, elem)
+        if self.metadata_ttl is not None:
+            opened = self._spreadsheets.get(key)
+            if opened is not None and time.time() - opened[0] <= self.metadata_ttl:
+                return opened[1]
 
-            m = _url_key_re_v2.search(alter_link.get('href'))
-            if m and m.group(1) == key:
-                return Spreadsheet(self, elem)
+        # The worksheets feed of a spreadsheet is addressed by its key and
+        # carries its title, so there is no need to search all spreadsheets
+        try:
+            feed = self.get_worksheets_feed(spreadsheet_id=key)
+        except HTTPError as ex:
+            if ex.code in (400, 403, 404):
+                raise SpreadsheetNotFound
+            raise
 
-        else:
-            raise SpreadsheetNotFound
+        spreadsheet = Spreadsheet(self, feed, key=key)
+        spreadsheet._set_sheets(feed)
+        if self.metadata_ttl is not None:
+            self._spreadsheets[key] = (time.time(), spreadsheet)
+        return spreadsheet
 
     def open_by_url(self, url):
         """Opens a spreadsheet specified by `url`,
@@ -229,10 +253,12 @@ class Client(object):
         r = self.session.get(url)
         return ElementTree.fromstring(r.read())
 
-    def get_worksheets_feed(self, spreadsheet,
-                            visibility='private', projection='full'):
+    def get_worksheets_feed(self, spreadsheet=None,
+                            visibility='private', projection='full',
+                            spreadsheet_id=None):
         url = construct_url('worksheets', spreadsheet,
-                            visibility=visibility, projection=projection)
+                            visibility=visibility, projection=projection,
+                            spreadsheet_id=spreadsheet_id)
 
         r = self.session.get(url)
         return ElementTree.fromstring(r.read())
@@ -250,6 +276,76 @@ class Client(object):
         r = self.session.get(url)
         return ElementTree.fromstring(r.read())
 
+    def cells_feed_url(self, worksheet,
+                       visibility='private', projection='full', params=None):
+        url = construct_url('cells', worksheet,
+                            visibility=visibility, projection=projection)
+
+        if params:
+            params = urlencode(params)
+            url = '%s?%s' % (url, params)
+        return url
+
+    def iter_entries(self, r):
+        """Yields `entry` elements of a feed response one at a time.
+
+        The response is parsed incrementally and every entry is detached
+        from the feed once it has been yielded, so the whole feed is never
+        held in memory at once.
+
+        """
+        entry_tag = _ns('entry')
+        root = None
+        try:
+            for event, elem in ElementTree.iterparse(r, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                elif event == 'end' and elem.tag == entry_tag:
+                    yield elem
+                    root.clear()
+        finally:
+            r.close()
+
+    def iter_cells_feed(self, worksheet,
+                        visibility='private', projection='full', params=None):
+        """Yields `entry` elements of a cells feed one at a time.
+
+        See :meth:`iter_entries`.
+
+        """
+        url = self.cells_feed_url(worksheet, visibility=visibility,
+                                  projection=projection, params=params)
+        return self.iter_entries(self.session.get(url))
+
+    def get_cached(self, url, parse):
+        """Returns `parse(response)` for the feed at `url`.
+
+        When a cache is enabled the request carries the ETag of the
+        cached result and that result is returned again if the server
+        answers `304 Not Modified`.
+
+        """
+        if self.cache is None:
+            return parse(self.session.get(url))
+
+        etag = self.cache.etag(url)
+        if etag is not None:
+            headers = {'GData-Version': '3.0', 'If-None-Match': etag}
+            r = self.session.get(url, headers=headers)
+            if r.status == 304:
+                r.read()
+                value = self.cache.hit(url)
+                if value is not None:
+                    return value
+                r = self.session.get(url, headers={'GData-Version': '3.0'})
+        else:
+            r = self.session.get(url, headers={'GData-Version': '3.0'})
+
+        etag = r.getheader('ETag')
+        value = parse(r)
+        self.cache.miss(url, etag, value)
+        return value
+
     def get_feed(self, url):
         r = self.session.get(url)
         return ElementTree.fromstring(r.read())
@@ -307,28 +403,38 @@ class Client(object):
         return ElementTree.fromstring(r.read())
 
 
-def login(email, password):
+def login(email, password, cache_size=0, metadata_ttl=None, rate_limit=None):
     """Login to Google API using `email` and `password`.
 
     This is a shortcut function which instantiates :class:`Client`
     and performs login right away.
 
+    :param cache_size: (optional) See :class:`Client`.
+    :param metadata_ttl: (optional) See :class:`Client`.
+    :param rate_limit: (optional) See :class:`Client`.
+
     :returns: :class:`Client` instance.
 
     """
-    client = Client(auth=(email, password))
+    client = Client(auth=(email, password), cache_size=cache_size,
+                    metadata_ttl=metadata_ttl, rate_limit=rate_limit)
     client.login()
     return client
 
-def authorize(credentials):
+def authorize(credentials, cache_size=0, metadata_ttl=None, rate_limit=None):
     """Login to Google API using OAuth2 credentials.
 
     This is a shortcut function which instantiates :class:`Client`
     and performs login right away.
 
+    :param cache_size: (optional) See :class:`Client`.
+    :param metadata_ttl: (optional) See :class:`Client`.
+    :param rate_limit: (optional) See :class:`Client`.
+
     :returns: :class:`Client` instance.
 
     """
-    client = Client(auth=credentials)
+    client = Client(auth=credentials, cache_size=cache_size,
+                    metadata_ttl=metadata_ttl, rate_limit=rate_limit)
     client.login()
     return client
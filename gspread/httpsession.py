@@ -8,6 +8,14 @@ This module contains a class for working with http sessions.
 
 """
 
+import gzip
+import io
+import select
+import socket
+import threading
+import time
+import zlib
+
 try:
     import httplib as client
     from urlparse import urlparse
@@ -24,18 +32,231 @@ except NameError:
 
 
 from .exceptions import HTTPError
+from .ratelimit import THROTTLE_STATUSES
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Errors raised by httplib when a kept-alive connection was closed by the
+# server while idle.
+CONNECTION_ERRORS = (client.BadStatusLine, client.CannotSendRequest,
+                     client.ResponseNotReady, client.IncompleteRead,
+                     socket.error)
+
+
+class PooledResponse(object):
+
+    """Wraps a response and returns its connection to the pool
+       once the body has been read completely.
+    """
+
+    def __init__(self, response, release, received=None):
+        self._response = response
+        self._release = release
+        self._received = received
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if data and self._received is not None:
+            self._received(len(data))
+        if amt is None or not data:
+            self._done()
+        return data
+
+    def close(self):
+        self._response.close()
+        self._release = None
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class DecodedResponse(object):
+
+    """Wraps a gzip or deflate encoded response and decompresses its
+       body incrementally as it is read.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, response, encoding):
+        self._response = response
+        self._encoding = encoding
+        if encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decoder = zlib.decompressobj(zlib.MAX_WBITS)
+        self._started = False
+        self._buffer = b''
+        self._eof = False
+
+    def _decompress(self, data):
+        if not self._started and self._encoding == 'deflate':
+            self._started = True
+            try:
+                return self._decoder.decompress(data)
+            except zlib.error:
+                # Some servers send raw deflate data without zlib header
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._started = True
+        return self._decoder.decompress(data)
+
+    def _fill(self, size=None):
+        while not self._eof and (size is None or len(self._buffer) < size):
+            data = self._response.read(self.chunk_size)
+            if data:
+                self._buffer += self._decompress(data)
+            else:
+                self._buffer += self._decoder.flush()
+                self._eof = True
+
+    def read(self, amt=None):
+        self._fill(amt)
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
 
 
 class HTTPSession(object):
 
     """Handles HTTP activity while keeping headers persisting across requests.
 
+       Connections are kept alive in a per-host pool and shared safely
+       between threads. The `requests`, `bytes_sent` and `bytes_received`
+       attributes count the traffic of the session, bodies only and as
+       sent on the wire, :meth:`thread_counters` that of the calling thread.
+
        :param headers: A dict with initial headers.
+       :param max_connections: Maximum number of idle connections kept
+                               per host.
+       :param max_idle: Seconds after which an idle connection is closed
+                        instead of being reused.
+       :param retries: How many times an idempotent request is retried
+                       on a fresh connection after a connection error.
+       :param timeout: (optional) Socket timeout in seconds.
+       :param compression: Whether to ask for gzip or deflate encoded
+                           responses and decompress them while reading.
+       :param compress_min_size: (optional) Request bodies of at least this
+                                 many bytes are sent gzip encoded.
+       :param rate_limiter: (optional) A :class:`~gspread.ratelimit.RateLimiter`
+                            every request waits for. Requests answered with
+                            429 or 503 are then retried after its backoff.
     """
 
-    def __init__(self, headers=None):
+    def __init__(self, headers=None, max_connections=4, max_idle=60,
+                 retries=1, timeout=None, compression=True,
+                 compress_min_size=None, rate_limiter=None):
         self.headers = headers or {}
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self.retries = retries
+        self.timeout = timeout
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.rate_limiter = rate_limiter
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        if compression:
+            # Google only serves gzip to user agents that mention it
+            self.headers.setdefault('Accept-Encoding', 'gzip, deflate')
+            self.headers.setdefault('User-Agent', 'gspread (gzip)')
+        # scheme+location -> list of (connection, idle since) tuples
         self.connections = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _new_connection(self, uri):
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if uri.scheme == 'https':
+            return client.HTTPSConnection(uri.netloc, **kwargs)
+        return client.HTTPConnection(uri.netloc, **kwargs)
+
+    def _is_healthy(self, connection, idle_since):
+        if time.time() - idle_since > self.max_idle:
+            return False
+        sock = connection.sock
+        if sock is None:
+            # Closed by httplib, it reconnects on next request by itself
+            return True
+        try:
+            # An idle keep-alive socket should have nothing to read; if it is
+            # readable the server has closed it
+            readable = select.select([sock], [], [], 0)[0]
+        except (select.error, ValueError, socket.error):
+            return False
+        return not readable
+
+    def _acquire(self, uri):
+        key = uri.scheme + uri.netloc
+        with self._lock:
+            pool = self.connections.setdefault(key, [])
+            while pool:
+                connection, idle_since = pool.pop()
+                if self._is_healthy(connection, idle_since):
+                    return connection
+                connection.close()
+        return self._new_connection(uri)
+
+    def _release(self, uri, connection):
+        key = uri.scheme + uri.netloc
+        with self._lock:
+            pool = self.connections.setdefault(key, [])
+            if len(pool) < self.max_connections:
+                pool.append((connection, time.time()))
+                return
+        connection.close()
+
+    def _thread_counters(self):
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = [0, 0, 0]
+        return counters
+
+    def thread_counters(self):
+        """Returns the `requests`, `bytes_sent` and `bytes_received` counts
+           of the requests sent and responses read by the calling thread,
+           its share of a session used by several threads.
+        """
+        return tuple(self._thread_counters())
+
+    def _received(self, size):
+        with self._lock:
+            self.bytes_received += size
+        self._thread_counters()[2] += size
+
+    def _compress(self, data):
+        buf = io.BytesIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb')
+        f.write(data)
+        f.close()
+        return buf.getvalue()
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            for pool in self.connections.values():
+                for connection, idle_since in pool:
+                    connection.close()
+            self.connections = {}
 
     def request(self, method, url, data=None, headers=None):
         if data and not isinstance(data, basestring):
@@ -44,21 +265,15 @@ class HTTPSession(object):
         if data is not None:
             data = data.encode()
 
+        headers = headers or {}
         # If we have data and Content-Type is not set, set it...
         if data and not headers.get('Content-Type', None):
             headers['Content-Type'] = 'application/x-www-form-urlencoded'
-        # If connection for this scheme+location is not established, establish
-        # it.
+
         uri = urlparse(url)
-        if not self.connections.get(uri.scheme + uri.netloc):
-            if uri.scheme == 'https':
-                self.connections[
-                    uri.scheme + uri.netloc] = client.HTTPSConnection(uri.netloc)
-            else:
-                self.connections[
-                    uri.scheme + uri.netloc] = client.HTTPConnection(uri.netloc)
 
-        request_headers = self.headers.copy()
+        with self._lock:
+            request_headers = self.headers.copy()
 
         if headers:
             for k, v in headers.items():
@@ -67,9 +282,53 @@ class HTTPSession(object):
                 else:
                     request_headers[k] = v
 
-        self.connections[
-            uri.scheme + uri.netloc].request(method, url, data, headers=request_headers)
-        response = self.connections[uri.scheme + uri.netloc].getresponse()
+        if (data and self.compress_min_size is not None and
+                len(data) >= self.compress_min_size and
+                'Content-Encoding' not in request_headers):
+            data = self._compress(data)
+            request_headers['Content-Encoding'] = 'gzip'
+
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            connection = self._acquire(uri)
+            with self._lock:
+                self.requests += 1
+                self.bytes_sent += len(data) if data else 0
+            counters = self._thread_counters()
+            counters[0] += 1
+            counters[1] += len(data) if data else 0
+            try:
+                connection.request(method, url, data, headers=request_headers)
+                response = connection.getresponse()
+            except CONNECTION_ERRORS:
+                connection.close()
+                if retries <= 0:
+                    raise
+                retries -= 1
+                continue
+            if (self.rate_limiter is not None and
+                    response.status in THROTTLE_STATUSES):
+                # Throttled requests were not carried out, so they are safe
+                # to send again whatever their method
+                delay = self.rate_limiter.backoff(
+                    attempt, response.getheader('Retry-After'))
+                if delay is not None:
+                    response.read()
+                    self._release(uri, connection)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+            break
+
+        response = PooledResponse(
+            response, lambda: self._release(uri, connection), self._received)
+
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding in ('gzip', 'deflate'):
+            response = DecodedResponse(response, encoding)
 
         if response.status > 399:
             raise HTTPError(response.status, "%s: %s" % (response.status, response.read()))
@@ -88,4 +347,5 @@ class HTTPSession(object):
         return self.request('PUT', url, data=data, **kwargs)
 
     def add_header(self, name, value):
-        self.headers[name] = value
+        with self._lock:
+            self.headers[name] = value
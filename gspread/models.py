@@ -9,8 +9,9 @@ This module contains common spreadsheets' models
 """
 
 import re
-from collections import defaultdict
-from itertools import chain
+import threading
+import time
+from collections import defaultdict, OrderedDict
 
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
@@ -18,7 +19,8 @@ from xml.etree.ElementTree import Element, SubElement
 from . import urlencode
 from .ns import _ns, _ns1, ATOM_NS, BATCH_NS, SPREADSHEET_NS
 from .urls import construct_url
-from .utils import finditem, numericise_all
+from .utils import (finditem, numericise_all, numericise_column,
+                    records_array)
 
 from .exceptions import IncorrectCellLabel, WorksheetNotFound, CellNotFound
 
@@ -48,26 +50,70 @@ def _escape_attrib(text, encoding=None, replace=None):
 ElementTree._escape_attrib = _escape_attrib
 
 
+def _xml_escape(text):
+    if text is None:
+        return u''
+    return (text.replace('&', '&amp;')
+                .replace('<', '&lt;')
+                .replace('>', '&gt;'))
+
+
+def _xml_escape_attrib(text):
+    if text is None:
+        return u''
+    return (_xml_escape(text).replace('"', '&quot;')
+                             .replace('\n', '&#10;')
+                             .replace('\r', '&#13;')
+                             .replace('\t', '&#9;'))
+
+
 class Spreadsheet(object):
 
-    """ A class for a spreadsheet object."""
+    """ A class for a spreadsheet object.
+
+    The worksheet list is kept until it is older than the client's
+    `metadata_ttl`, then fetched again on next use.
 
-    def __init__(self, client, feed_entry):
+    """
+
+    def __init__(self, client, feed_entry, key=None):
         self.client = client
         self._sheet_list = []
+        self._sheets_fetched = None
         self._feed_entry = feed_entry
+        self._key = key
 
     @property
     def id(self):
+        if self._key is not None:
+            return self._key
         return self._feed_entry.find(_ns('id')).text.split('/')[-1]
 
     def get_id_fields(self):
         return {'spreadsheet_id': self.id}
 
     def _fetch_sheets(self):
-        feed = self.client.get_worksheets_feed(self)
+        self._set_sheets(self.client.get_worksheets_feed(self))
+
+    def _set_sheets(self, feed):
+        # Worksheets already handed out are updated in place, so they
+        # stay valid across refreshes
+        known = dict((sheet.id, sheet) for sheet in self._sheet_list)
+        sheets = []
         for elem in feed.findall(_ns('entry')):
-            self._sheet_list.append(Worksheet(self, elem))
+            sheet = Worksheet(self, elem)
+            if sheet.id in known:
+                known[sheet.id]._set_element(elem)
+                sheet = known[sheet.id]
+            sheets.append(sheet)
+        self._sheet_list = sheets
+        self._sheets_fetched = time.time()
+
+    def _sheets_expired(self):
+        if self._sheets_fetched is None:
+            return True
+        ttl = self.client.metadata_ttl
+        return ttl is not None and time.time() - self._sheets_fetched > ttl
 
     def add_worksheet(self, title, rows, cols):
         """Adds a new worksheet to a spreadsheet.
@@ -107,7 +153,7 @@ class Spreadsheet(object):
         in a spreadsheet.
 
         """
-        if not self._sheet_list:
+        if self._sheets_expired():
             self._fetch_sheets()
         return self._sheet_list[:]
 
@@ -126,7 +172,7 @@ class Spreadsheet(object):
         >>> worksheet = sht.worksheet('Annual bonuses')
 
         """
-        if not self._sheet_list:
+        if self._sheets_expired():
             self._fetch_sheets()
 
         try:
@@ -148,7 +194,7 @@ class Spreadsheet(object):
 
         Returns `None` if the worksheet is not found.
         """
-        if not self._sheet_list:
+        if self._sheets_expired():
             self._fetch_sheets()
         try:
             return self._sheet_list[index]
@@ -172,6 +218,10 @@ class Worksheet(object):
     def __init__(self, spreadsheet, element):
         self.spreadsheet = spreadsheet
         self.client = spreadsheet.client
+        self._key_index = {}
+        self._set_element(element)
+
+    def _set_element(self, element):
         self._id = element.find(_ns('id')).text.split('/')[-1]
         self._title = element.find(_ns('title')).text
         self._element = element
@@ -223,11 +273,28 @@ class Worksheet(object):
         return finditem(lambda x: x.get('rel') == link_type,
                         feed.findall(_ns('link')))
 
+    def _iter_cells(self, params=None):
+        client = self.client
+        if client.cache is None:
+            for elem in client.iter_cells_feed(self, params=params):
+                yield Cell(self, elem)
+            return
+
+        url = client.cells_feed_url(self, params=params)
+        cells = client.get_cached(url, lambda r: [
+            Cell(self, elem) for elem in client.iter_entries(r)])
+        for cell in cells:
+            yield cell._copy()
+
     def _fetch_cells(self):
-        feed = self.client.get_cells_feed(self)
-        return [Cell(self, elem) for elem in feed.findall(_ns('entry'))]
+        return list(self._iter_cells())
 
     _MAGIC_NUMBER = 64
+    _MAX_FEED_SIZE = 1024 * 1024
+    _UPDATE_ENTRY = (u'<entry><batch:id>%s</batch:id>'
+                     u'<batch:operation type="update"/><id>%s</id>'
+                     u'<link rel="edit" type="%s" href="%s"/>'
+                     u'<gs:cell row="%d" col="%d" inputValue="%s"/></entry>')
     _cell_addr_re = re.compile(r'([A-Za-z]+)(\d+)')
 
     def get_int_addr(self, label):
@@ -320,9 +387,17 @@ class Worksheet(object):
         <Cell R1C1 "I'm cell A1">
 
         """
-        feed = self.client.get_cells_cell_id_feed(self,
-                                                  self._cell_addr(row, col))
-        return Cell(self, feed)
+        client = self.client
+        if client.cache is None:
+            feed = client.get_cells_cell_id_feed(self,
+                                                 self._cell_addr(row, col))
+            return Cell(self, feed)
+
+        url = construct_url('cells_cell_id', self,
+                            cell_id=self._cell_addr(row, col))
+        cell = client.get_cached(url, lambda r: Cell(
+            self, ElementTree.fromstring(r.read())))
+        return cell._copy()
 
     def range(self, alphanum):
         """Returns a list of :class:`Cell` objects from specified range.
@@ -331,30 +406,61 @@ class Worksheet(object):
                          e.g. 'A1:A5'.
 
         """
-        feed = self.client.get_cells_feed(self, params={'range': alphanum,
-                                                        'return-empty': 'true'})
-        return [Cell(self, elem) for elem in feed.findall(_ns('entry'))]
+        return list(self._iter_cells(params={'range': alphanum,
+                                             'return-empty': 'true'}))
 
-    def get_all_values(self):
-        """Returns a list of lists containing all cells' values as strings."""
-        cells = self._fetch_cells()
+    def get_all_values(self, min_row=None, max_row=None,
+                       min_col=None, max_col=None, sparse=False):
+        """Returns a list of lists containing all cells' values as strings.
 
-        # defaultdicts fill in gaps for empty rows/cells not returned by gdocs
-        rows = defaultdict(lambda: defaultdict(str))
-        for cell in cells:
-            row = rows.setdefault(int(cell.row), defaultdict(str))
-            row[cell.col] = cell.value
+        Only the non-empty cells are read. The bounds limit the read to a
+        part of the worksheet; the first row and column of the result are
+        then `min_row` and `min_col`.
 
-        # we return a whole rectangular region worth of cells, including
-        # empties
-        if not rows:
-            return []
+        :param min_row: (optional) First row to read.
+        :param max_row: (optional) Last row to read.
+        :param min_col: (optional) First column to read.
+        :param max_col: (optional) Last column to read.
+        :param sparse: If set, returns a dictionary of the non-empty
+                       values keyed by `(row, col)` tuples instead.
+
+        """
+        params = {}
+        for name, bound in (('min-row', min_row), ('max-row', max_row),
+                            ('min-col', min_col), ('max-col', max_col)):
+            if bound is not None:
+                params[name] = bound
+        cells = self._iter_cells(params=params or None)
 
-        all_row_keys = chain.from_iterable(row.keys() for row in rows.values())
-        rect_cols = range(1, max(all_row_keys) + 1)
-        rect_rows = range(1, max(rows.keys()) + 1)
+        if sparse:
+            return dict(((cell.row, cell.col), cell.value) for cell in cells)
 
-        return [[rows[i][j] for j in rect_cols] for i in rect_rows]
+        first_row = min_row or 1
+        first_col = min_col or 1
+
+        # we return a whole rectangular region worth of cells, including
+        # empties; rows missing from the feed stay shared empty lists
+        # until they are padded
+        empty = []
+        rows = []
+        width = 0
+        for cell in cells:
+            i = cell.row - first_row
+            j = cell.col - first_col
+            if i >= len(rows):
+                rows.extend([empty] * (i + 1 - len(rows)))
+            row = rows[i]
+            if row is empty:
+                row = rows[i] = []
+            if j >= len(row):
+                row.extend([''] * (j + 1 - len(row)))
+                width = max(width, j + 1)
+            row[j] = cell.value
+
+        for i, row in enumerate(rows):
+            if len(row) < width:
+                rows[i] = row + [''] * (width - len(row))
+        return rows
 
     def get_all_records(self, empty2zero=False, head=1):
         """Returns a list of dictionaries, all of them having:
@@ -374,9 +480,64 @@ class Worksheet(object):
 
         data = self.get_all_values()
         keys = data[idx]
-        values = [numericise_all(row, empty2zero) for row in data[idx + 1:]]
+        # Numericising column by column lets whole numeric columns go
+        # through the fast path of numericise_all
+        columns = [numericise_all(column, empty2zero)
+                   for column in zip(*data[idx + 1:])]
+
+        return [dict(zip(keys, row)) for row in zip(*columns)]
+
+    def _typed_columns(self, empty2zero=False, head=1):
+        values = defaultdict(dict)
+        numeric_values = {}
+        max_col = 0
+        for cell in self._iter_cells():
+            values[cell.row][cell.col] = cell.value
+            if cell.numeric_value is not None:
+                numeric_values[(cell.row, cell.col)] = cell.numeric_value
+            max_col = max(max_col, cell.col)
+
+        if not values:
+            return [], []
+
+        keys = [values[head].get(col, '') for col in range(1, max_col + 1)]
+        rows = range(head + 1, max(values.keys()) + 1)
+        columns = []
+        for col in range(1, max_col + 1):
+            columns.append(numericise_column(
+                [values[row].get(col, '') for row in rows],
+                [numeric_values.get((row, col)) for row in rows],
+                empty2zero))
+        return keys, columns
+
+    def get_all_columns(self, empty2zero=False, head=1):
+        """Returns an ordered dictionary of the columns below the `head`
+        row keyed by their head cell.
+
+        Each column is converted as a whole to integers, floats or left
+        as strings, using the numeric values from the cells feed where
+        all its non-empty cells have one. Empty cells of numeric columns
+        become :const:`None`.
+
+        :param empty2zero: determines whether empty cells of numeric
+            columns are converted to zeros.
+        :param head: determines wich row to use as keys, starting from 1
+            following the numeration of the spreadsheet."""
+        keys, columns = self._typed_columns(empty2zero, head)
+        return OrderedDict((key, values) for key, (kind, values)
+                           in zip(keys, columns))
+
+    def get_records_array(self, head=1):
+        """Returns the rows below the `head` row as a NumPy record array
+        with the head cells as field names. Columns are typed as in
+        :meth:`get_all_columns`, missing numbers are NaN.
+
+        :param head: determines wich row to use as keys, starting from 1
+            following the numeration of the spreadsheet.
 
-        return [dict(zip(keys, row)) for row in values]
+        :raises ImportError: if NumPy is not installed."""
+        keys, columns = self._typed_columns(head=head)
+        return records_array(keys, columns)
 
     def row_values(self, row):
         """Returns a list of all values in a `row`.
@@ -402,6 +563,57 @@ class Worksheet(object):
         row_cells = self.range('%s:%s' % (start_cell, end_cell))
         return [cell.value for cell in row_cells]
 
+    def build_index(self, col=1):
+        """Builds a lookup index of values in column `col`.
+
+        The index maps every non-empty value in the column to the first
+        row holding it. It is invalidated by writes made through this
+        worksheet object; call this method again to refresh it after
+        changes made elsewhere.
+
+        :param col: Column number to index.
+
+        """
+        index = {}
+        for row, value in enumerate(self.col_values(col), start=1):
+            if value and value not in index:
+                index[value] = row
+        self._key_index[col] = index
+        return index
+
+    def find_row(self, value, col=1):
+        """Returns the number of the first row where column `col` equals `value`.
+
+        Uses the index built by :meth:`build_index`, building it first
+        if needed, so repeated lookups don't download the column again.
+
+        :param value: Value to look for.
+        :param col: Column number to search.
+
+        :raises gspread.CellNotFound: if no cell in the column has `value`.
+
+        """
+        index = self._key_index.get(col)
+        if index is None:
+            index = self.build_index(col)
+        try:
+            return index[value]
+        except KeyError:
+            raise CellNotFound(value)
+
+    def invalidate_index(self, cols=None):
+        """Drops lookup indexes built by :meth:`build_index`.
+
+        :param cols: (optional) Column numbers to drop. All indexes are
+                     dropped if not specified.
+
+        """
+        if cols is None:
+            self._key_index = {}
+        else:
+            for col in cols:
+                self._key_index.pop(col, None)
+
     def update_acell(self, label, val):
         """Sets the new value to a cell.
 
@@ -432,44 +644,77 @@ class Worksheet(object):
         uri = self._get_link('edit', feed).get('href')
 
         self.client.put_feed(uri, ElementTree.tostring(feed))
+        self.invalidate_index([col])
 
-    def _create_update_feed(self, cell_list):
-        feed = Element('feed', {'xmlns': ATOM_NS,
-                                'xmlns:batch': BATCH_NS,
-                                'xmlns:gs': SPREADSHEET_NS})
+    def _iter_update_feeds(self, cell_list, max_size=None):
+        """Yields batch update feeds for `cell_list` as encoded XML.
 
-        id_elem = SubElement(feed, 'id')
+        Entries are written straight from the cells' edit metadata. A new
+        feed is started whenever the current one would grow past
+        `max_size` bytes.
 
-        id_elem.text = construct_url('cells', self)
+        """
+        if max_size is None:
+            max_size = self._MAX_FEED_SIZE
 
-        for cell in cell_list:
-            entry = SubElement(feed, 'entry')
+        head = ('<feed xmlns="%s" xmlns:batch="%s" xmlns:gs="%s"><id>%s</id>'
+                % (ATOM_NS, BATCH_NS, SPREADSHEET_NS,
+                   _xml_escape(construct_url('cells', self)))).encode('ascii')
+        tail = b'</feed>'
 
-            SubElement(entry, 'batch:id').text = cell.element.find(
-                _ns('title')).text
-            SubElement(entry, 'batch:operation', {'type': 'update'})
-            SubElement(entry, 'id').text = cell.element.find(_ns('id')).text
+        buf = [head]
+        size = len(head) + len(tail)
+        for cell in cell_list:
+            entry = self._UPDATE_ENTRY % (
+                _xml_escape(cell._title),
+                _xml_escape(cell._id),
+                _xml_escape_attrib(cell._edit_type),
+                _xml_escape_attrib(cell._edit_href),
+                cell.row, cell.col,
+                _xml_escape_attrib(unicode(cell.value)))
+            entry = entry.encode('ascii', 'xmlcharrefreplace')
+
+            if len(buf) > 1 and size + len(entry) > max_size:
+                buf.append(tail)
+                yield b''.join(buf)
+                buf = [head]
+                size = len(head) + len(tail)
+
+            buf.append(entry)
+            size += len(entry)
+
+        if len(buf) > 1:
+            buf.append(tail)
+            yield b''.join(buf)
+
+    def update_cells(self, cell_list, max_size=None):
+        """Updates cells in batch.
 
-            edit_link = finditem(lambda x: x.get('rel') == 'edit',
-                                 cell.element.findall(_ns('link')))
+        Large updates are split into several batch requests which are sent
+        one after another.
 
-            SubElement(entry, 'link', {'rel': 'edit',
-                                       'type': edit_link.get('type'),
-                                       'href': edit_link.get('href')})
+        :param cell_list: List of a :class:`Cell` objects to update.
+        :param max_size: (optional) Maximum size in bytes of a single batch
+                         request.
 
-            SubElement(entry, 'gs:cell', {'row': str(cell.row),
-                                          'col': str(cell.col),
-                                          'inputValue': unicode(cell.value)})
-        return feed
+        """
+        try:
+            for feed in self._iter_update_feeds(cell_list, max_size):
+                self.client.post_cells(self, feed)
+        finally:
+            self.invalidate_index(set(cell.col for cell in cell_list))
 
-    def update_cells(self, cell_list):
-        """Updates cells in batch.
+    def update_values(self, values, max_size=None):
+        """Updates cells in batch from their new values, without reading
+        the cells first.
 
-        :param cell_list: List of a :class:`Cell` objects to update.
+        :param values: A dict of values keyed by `(row, col)` tuples.
+        :param max_size: (optional) See :meth:`update_cells`.
 
         """
-        feed = self._create_update_feed(cell_list)
-        self.client.post_cells(self, ElementTree.tostring(feed))
+        self.update_cells([self._new_cell(row, col, value)
+                           for (row, col), value in sorted(values.items())],
+                          max_size)
 
     def resize(self, rows=None, cols=None):
         """Resizes the worksheet.
@@ -494,6 +739,7 @@ class Worksheet(object):
 
         # Send request and store result
         self._element = self.client.put_feed(uri, ElementTree.tostring(feed))
+        self.invalidate_index()
 
     def add_rows(self, rows):
         """Adds rows to worksheet.
@@ -509,6 +755,20 @@ class Worksheet(object):
         """
         self.resize(cols=self.col_count + cols)
 
+    def _new_cell(self, row, col, value):
+        # A cell that can be sent in a batch update without reading it
+        # first; the unversioned cell URL is accepted as its edit link
+        cell = Cell(self)
+        cell._row = row
+        cell._col = col
+        cell.value = value
+        cell.input_value = cell.numeric_value = None
+        cell._title = self.get_addr_int(row, col)
+        cell._id = cell._edit_href = construct_url(
+            'cells_cell_id', self, cell_id=self._cell_addr(row, col))
+        cell._edit_type = 'application/atom+xml'
+        return cell
+
     def append_row(self, values):
         """Adds a row to the worksheet and populates it with values.
         Widens the worksheet if there are more values than columns.
@@ -518,17 +778,28 @@ class Worksheet(object):
 
         :param values: List of values for the new row.
         """
-        self.add_rows(1)
-        new_row = self.row_count
-        data_width = len(values)
-        if self.col_count < data_width:
-            self.resize(cols=data_width)
+        self.append_rows([values])
+
+    def append_rows(self, rows):
+        """Adds rows to the worksheet and populates them with values.
+        Widens the worksheet if there are more values than columns.
+
+        The worksheet is resized once and all values are written in
+        a single batch update.
+
+        :param rows: List of lists of values for the new rows.
+        """
+        if not rows:
+            return
+        first_row = self.row_count + 1
+        data_width = max(len(values) for values in rows)
+        self.resize(rows=self.row_count + len(rows),
+                    cols=max(self.col_count, data_width))
 
         cell_list = []
-        for i, value in enumerate(values, start=1):
-            cell = self.cell(new_row, i)
-            cell.value = value
-            cell_list.append(cell)
+        for rownum, values in enumerate(rows, start=first_row):
+            for colnum, value in enumerate(values, start=1):
+                cell_list.append(self._new_cell(rownum, colnum, value))
 
         self.update_cells(cell_list)
 
@@ -538,36 +809,70 @@ class Worksheet(object):
 
         :param values: List of values for the new row.
         """
+        self.insert_rows(index, [values])
+
+    def insert_rows(self, index, rows):
+        """Adds rows to the worksheet at the specified index and populates
+        them with values. Widens the worksheet if there are more values
+        than columns.
+
+        Rows at or below `index` are moved down: they are read in a single
+        query, the worksheet is resized once and only cells whose value
+        changes are written, in a single batch update.
+
+        :param index: Row number the first new row will have.
+        :param rows: List of lists of values for the new rows.
+        """
         if index == self.row_count + 1:
-            return self.append_row(values)
+            return self.append_rows(rows)
         elif index > self.row_count + 1:
             raise IndexError('Row index out of range')
+        if not rows:
+            return
+
+        # Only non-empty cells are returned, so trailing blank rows cost
+        # nothing to read
+        old_values = {}
+        last_row = index - 1
+        data_width = max(len(values) for values in rows)
+        for cell in self._iter_cells(params={
+                'min-row': index, 'max-row': self.row_count}):
+            old_values[(cell.row, cell.col)] = cell.value
+            last_row = max(last_row, cell.row)
+            data_width = max(data_width, cell.col)
+
+        count = len(rows)
+        self.resize(rows=self.row_count + count,
+                    cols=max(self.col_count, data_width))
 
-        self.add_rows(1)
-        data_width = len(values)
-        if self.col_count < data_width:
-            self.resize(cols=data_width)
-
-        # Retrieve all Cells at or below `index` using a single batch query
-        top_left = self.get_addr_int(index, 1)
-        bottom_right = self.get_addr_int(self.row_count, self.col_count)
-        range_str = '%s:%s' % (top_left, bottom_right)
+        cell_list = []
+        for rownum in range(index, last_row + count + 1):
+            if rownum < index + count:
+                values = rows[rownum - index]
+            else:
+                values = None
+            for colnum in range(1, data_width + 1):
+                if values is not None:
+                    new_val = values[colnum - 1] if colnum <= len(values) else ''
+                else:
+                    new_val = old_values.get((rownum - count, colnum), '')
+                if new_val != old_values.get((rownum, colnum), ''):
+                    cell_list.append(self._new_cell(rownum, colnum, new_val))
 
-        cells_after_insert = self.range(range_str)
+        self.update_cells(cell_list)
+        self.invalidate_index()
 
-        for ind, cell in reversed(list(enumerate(cells_after_insert))):
-            if ind < self.col_count:
-                # For the first row, take the cell values from `values`
-                new_val = values[ind] if ind < len(values) else ''
-            else:
-                # For all other rows, take the cell values from the row above
-                new_val = cells_after_insert[ind - self.col_count].value
-            cell.value = new_val
+    def row_writer(self, max_rows=50, max_delay=10):
+        """Returns a :class:`RowWriter` appending rows to this worksheet.
 
-        self.update_cells(cells_after_insert)
+        :param max_rows: Rows buffered before they are written.
+        :param max_delay: Seconds a buffered row waits at most before
+                          it is written.
+        """
+        return RowWriter(self, max_rows=max_rows, max_delay=max_delay)
 
     def _finder(self, func, query):
-        cells = self._fetch_cells()
+        cells = self._iter_cells()
 
         if isinstance(query, basestring):
             match = lambda x: x.value == query
@@ -618,11 +923,37 @@ class Cell(object):
     """An instance of this class represents a single cell
     in a :class:`worksheet <Worksheet>`.
 
+    Only the values and the few strings needed to send the cell back in a
+    batch update are kept, so the feed entry it was read from can be freed.
+
     """
 
-    def __init__(self, worksheet, element):
-        self.element = element
-        cell_elem = element.find(_ns1('cell'))
+    __slots__ = ('_row', '_col', 'value', 'input_value', 'numeric_value',
+                 '_id', '_title', '_edit_type', '_edit_href')
+
+    _id_tag = _ns('id')
+    _title_tag = _ns('title')
+    _link_tag = _ns('link')
+    _cell_tag = _ns1('cell')
+
+    def __init__(self, worksheet, element=None):
+        if element is None:
+            return
+        self._id = self._title = None
+        self._edit_type = self._edit_href = None
+        cell_elem = None
+        for child in element:
+            tag = child.tag
+            if tag == self._cell_tag:
+                cell_elem = child
+            elif tag == self._id_tag:
+                self._id = child.text
+            elif tag == self._title_tag:
+                self._title = child.text
+            elif tag == self._link_tag and child.get('rel') == 'edit':
+                self._edit_type = child.get('type')
+                self._edit_href = child.get('href')
+
         self._row = int(cell_elem.get('row'))
         self._col = int(cell_elem.get('col'))
         self.input_value = cell_elem.get('inputValue')
@@ -632,6 +963,12 @@ class Cell(object):
         #: Value of the cell.
         self.value = cell_elem.text or ''
 
+    def _copy(self):
+        cell = Cell(None)
+        for name in self.__slots__:
+            setattr(cell, name, getattr(self, name))
+        return cell
+
     @property
     def row(self):
         """Row number of the cell."""
@@ -647,3 +984,67 @@ class Cell(object):
                                    self.row,
                                    self.col,
                                    repr(self.value))
+
+
+class RowWriter(object):
+
+    """Buffers rows appended to a :class:`worksheet <Worksheet>` and writes
+    them with :meth:`Worksheet.append_rows` once `max_rows` rows are
+    waiting or the oldest of them has waited `max_delay` seconds.
+
+    Call :meth:`close` (or use the writer in a `with` block) to write
+    the remaining rows.
+
+    """
+
+    def __init__(self, worksheet, max_rows=50, max_delay=10):
+        self.worksheet = worksheet
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows = []
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def append(self, values):
+        """Buffers a row of values."""
+        with self._lock:
+            self._rows.append(values)
+            if len(self._rows) >= self.max_rows:
+                self.flush()
+            elif self._timer is None and self.max_delay is not None:
+                self._timer = threading.Timer(self.max_delay, self._expired)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _expired(self):
+        with self._lock:
+            self._timer = None
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered rows now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            rows, self._rows = self._rows, []
+            if rows:
+                try:
+                    self.worksheet.append_rows(rows)
+                except Exception:
+                    # Keep the rows for the next flush
+                    self._rows[:0] = rows
+                    raise
+
+    def close(self):
+        """Writes the remaining rows and stops the timer."""
+        self.flush()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
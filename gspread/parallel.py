@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+gspread.parallel
+~~~~~~~~~~~~~~~~
+
+This module contains a client running independent requests concurrently.
+
+"""
+
+import threading
+
+try:
+    from Queue import Queue
+    from urlparse import urlparse
+except ImportError:
+    from queue import Queue
+    from urllib.parse import urlparse
+
+from . import urls
+
+
+class Future(object):
+
+    """The pending result of an operation submitted to a
+       :class:`ConcurrentClient`.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def _set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def done(self):
+        """Returns whether the operation has finished."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the operation and returns its result, or raises
+           the exception it raised.
+
+        :param timeout: (optional) Seconds to wait before giving up with
+                        a :class:`RuntimeError`.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Operation did not finish in time')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Waits for the operation and returns the exception it raised,
+           or :const:`None`.
+        """
+        self._done.wait(timeout)
+        return self._exception
+
+
+class ConcurrentClient(object):
+
+    """Runs :class:`~gspread.Client` operations on a pool of threads so
+       independent reads and writes overlap instead of waiting for one
+       another. Every method returns a :class:`Future` right away.
+
+       :param client: A logged in :class:`~gspread.Client`. Its HTTP
+                      session is shared by all threads.
+       :param max_workers: Number of threads.
+       :param max_per_host: Maximum number of operations running against
+                            the same host at once. Every operation is
+                            counted against the spreadsheets feed host, so
+                            this caps all operations of the client, not
+                            each host they may end up talking to.
+
+       >>> pool = ConcurrentClient(gspread.authorize(credentials))
+       >>> sheet = pool.open_by_key(key).result()
+       >>> first, second = pool.gather(
+       ...     pool.get_all_values(sheet.worksheet('First')),
+       ...     pool.get_all_values(sheet.worksheet('Second')))
+
+       Threads are used rather than an event loop since the library keeps
+       supporting Python 2.
+    """
+
+    def __init__(self, client, max_workers=8, max_per_host=4):
+        self.client = client
+        self.max_per_host = max_per_host
+        self._queue = Queue()
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _slots(self, host):
+        with self._lock:
+            slots = self._host_slots.get(host)
+            if slots is None:
+                slots = threading.BoundedSemaphore(self.max_per_host)
+                self._host_slots[host] = slots
+            return slots
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, host, func, args, kwargs = task
+            slots = self._slots(host)
+            slots.acquire()
+            try:
+                future._set_result(func(*args, **kwargs))
+            except Exception as e:
+                future._set_exception(e)
+            finally:
+                slots.release()
+
+    def submit(self, func, *args, **kwargs):
+        """Runs `func(*args, **kwargs)` on the pool and returns a
+           :class:`Future` of its result. The call counts against the
+           concurrency cap of the spreadsheets host.
+        """
+        if not self._workers:
+            raise RuntimeError('ConcurrentClient has been closed')
+        future = Future()
+        host = urlparse(urls.SPREADSHEETS_FEED_URL).netloc
+        self._queue.put((future, host, func, args, kwargs))
+        return future
+
+    def gather(self, *futures):
+        """Waits for all `futures` and returns their results in order."""
+        return [future.result() for future in futures]
+
+    def open_by_key(self, key):
+        """See :meth:`gspread.Client.open_by_key`."""
+        return self.submit(self.client.open_by_key, key)
+
+    def worksheets(self, spreadsheet):
+        """See :meth:`gspread.Spreadsheet.worksheets`."""
+        return self.submit(spreadsheet.worksheets)
+
+    def range(self, worksheet, alphanum):
+        """See :meth:`gspread.Worksheet.range`."""
+        return self.submit(worksheet.range, alphanum)
+
+    def get_all_values(self, worksheet, **kwargs):
+        """See :meth:`gspread.Worksheet.get_all_values`."""
+        return self.submit(worksheet.get_all_values, **kwargs)
+
+    def update_cells(self, worksheet, cell_list, **kwargs):
+        """See :meth:`gspread.Worksheet.update_cells`."""
+        return self.submit(worksheet.update_cells, cell_list, **kwargs)
+
+    def close(self):
+        """Lets the submitted operations finish and stops the threads."""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
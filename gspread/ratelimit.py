@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+gspread.ratelimit
+~~~~~~~~~~~~~~~~~
+
+This module contains a rate limiter for requests made with one credential.
+
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+
+# Responses telling us to slow down: quota exceeded and backend overloaded
+THROTTLE_STATUSES = (429, 503)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def parse_retry_after(value):
+    """Returns the seconds to wait from a `Retry-After` header value,
+       given either as seconds or as an HTTP date, or `None`.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+
+class RateLimiter(object):
+
+    """Spaces out requests with a token bucket and decides how long to
+       back off when the server throttles them.
+
+       :param rate: Requests per second allowed on average.
+       :param burst: Requests that may be sent at once after being idle.
+       :param max_retries: How many times a throttled request is retried.
+       :param backoff: Seconds to wait after the first throttled response,
+                       doubled for every further one.
+       :param max_backoff: Longest wait between retries in seconds.
+
+       A throttled response also empties the bucket, so every request
+       sharing the limiter slows down rather than only the one that was
+       refused.
+    """
+
+    def __init__(self, rate=5, burst=10, max_retries=5, backoff=1,
+                 max_backoff=64):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff
+        self.max_backoff = max_backoff
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+        #: Requests let through.
+        self.requests = 0
+        #: Requests that had to wait for a token.
+        self.delayed = 0
+        #: Seconds spent waiting for tokens.
+        self.wait_time = 0.0
+        #: Throttled responses (429 or 503) received.
+        self.throttled = 0
+        #: Throttled requests sent again.
+        self.retries = 0
+        #: Throttled requests given up after `max_retries`.
+        self.failures = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Waits until a request may be sent."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests += 1
+                    if waited > 0:
+                        self.delayed += 1
+                        self.wait_time += waited
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def backoff(self, attempt, retry_after=None):
+        """Returns the seconds to wait before retrying a throttled
+           request for the `attempt`-th time (starting at 0), or `None`
+           if it should not be retried.
+
+        :param retry_after: (optional) The response's `Retry-After`
+                            header value.
+        """
+        with self._lock:
+            self.throttled += 1
+            if attempt >= self.max_retries:
+                self.failures += 1
+                return None
+            self.retries += 1
+            self.tokens = 0
+            self.updated = time.time()
+
+        delay = min(self.max_backoff, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(delay / 2.0, delay)
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def stats(self):
+        """Returns a dict of the counters and the tokens left."""
+        with self._lock:
+            self._refill(time.time())
+            return {'requests': self.requests,
+                    'delayed': self.delayed,
+                    'wait_time': self.wait_time,
+                    'throttled': self.throttled,
+                    'retries': self.retries,
+                    'failures': self.failures,
+                    'tokens': self.tokens}
+
+
+def credential_key(auth):
+    """Returns a key identifying the account behind `auth`, either an
+       OAuth2 credential object or an (email, password) tuple.
+    """
+    if isinstance(auth, tuple):
+        return auth[0]
+    return (getattr(auth, 'client_id', None),
+            getattr(auth, 'refresh_token', None) or id(auth))
+
+
+def shared_limiter(auth, **kwargs):
+    """Returns the :class:`RateLimiter` shared by every client using the
+       same credential, creating it with `kwargs` on first use.
+    """
+    key = credential_key(auth)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(**kwargs)
+            _limiters[key] = limiter
+        return limiter
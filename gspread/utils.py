@@ -10,6 +10,11 @@ This module contains utility functions.
 
 from xml.etree import ElementTree
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def finditem(func, seq):
     """Finds and returns first item in iterable for which func(item) is True.
@@ -84,8 +89,98 @@ def numericise(value, empty2zero=False):
 
 
 def numericise_all(input, empty2zero=False):
-    """Returns a list of numericised values from strings"""
-    return [numericise(s, empty2zero) for s in input]
+    """Returns a list of numericised values from strings
+
+    The whole list is first converted as integers; values are only
+    numericised one by one when that fails.
+
+    >>> numericise_all(["1", "2", ""], empty2zero=True)
+    [1, 2, 0]
+    >>> numericise_all(["1", "2.5", "faa"])
+    [1, 2.5, 'faa']
+    """
+    try:
+        empty = 0 if empty2zero else ''
+        return [int(s) if s != '' else empty for s in input]
+    except (ValueError, TypeError):
+        return [numericise(s, empty2zero) for s in input]
+
+
+def numericise_column(values, numeric_values=None, empty2zero=False):
+    """Converts a whole column of strings to a single type at once.
+
+    Returns a tuple of the column type (`int`, `float` or `str`) and the
+    list of converted values. Empty values become :const:`None` in
+    numeric columns, or zero if `empty2zero` is set.
+
+    :param values: List of cell values as strings.
+    :param numeric_values: (optional) List of the cells' numeric values
+                           as parsed from the feed, :const:`None` where
+                           a cell has none. Used for the column's numbers
+                           when every non-empty cell has one, as long as
+                           the displayed `values` are numbers themselves,
+                           so dates and times are kept as text.
+
+    >>> numericise_column(["1", "", "3"]) == (int, [1, None, 3])
+    True
+    >>> numericise_column(["1", "2.5"]) == (float, [1.0, 2.5])
+    True
+    >>> numericise_column(["1", "faa"]) == (str, ["1", "faa"])
+    True
+    >>> numericise_column(["33", "1"], [33.25, 1.0]) == (float, [33.25, 1.0])
+    True
+    >>> numericise_column(["1/2/2015", "3"], [42006.0, 3.0]) == (str, ["1/2/2015", "3"])
+    True
+    """
+    filled = [i for i, value in enumerate(values) if value != '']
+    if not filled:
+        return str, list(values)
+
+    try:
+        numbers = [int(values[i]) for i in filled]
+        kind = int
+    except ValueError:
+        try:
+            numbers = [float(values[i]) for i in filled]
+            kind = float
+        except ValueError:
+            return str, list(values)
+
+    if numeric_values is not None and all(
+            numeric_values[i] is not None for i in filled):
+        numbers = [numeric_values[i] for i in filled]
+        kind = int if all(n == int(n) for n in numbers) else float
+
+    column = [0 if empty2zero else None] * len(values)
+    for i, number in zip(filled, numbers):
+        column[i] = kind(number)
+    return kind, column
+
+
+def records_array(keys, columns):
+    """Returns typed columns as a NumPy record array.
+
+    :param keys: Field names.
+    :param columns: List of tuples of a column type and values,
+                    as returned by :func:`numericise_column`.
+
+    Integer columns with missing values are stored as floats, missing
+    numbers become NaN.
+    """
+    if numpy is None:
+        raise ImportError('NumPy is required for record arrays')
+
+    arrays = []
+    for kind, values in columns:
+        if kind is str:
+            arrays.append(numpy.array(values, dtype=object))
+        elif kind is int and None not in values:
+            arrays.append(numpy.array(values, dtype=numpy.int64))
+        else:
+            arrays.append(numpy.array(
+                [numpy.nan if v is None else v for v in values],
+                dtype=numpy.float64))
+    return numpy.rec.fromarrays(arrays, names=[str(key) for key in keys])
 
 
 if __name__ == '__main__':
@@ -1,22 +1,276 @@
 import sys
 import re
 import os
+import time
+import json
+import hashlib
+import tempfile
+import random
+import threading
+try:
+	import Queue as queue
+except ImportError:
+	import queue
 import mechanize
 from bs4 import BeautifulSoup
+import grader_client
 
-GRADER_BASE = "http://grader.eng.src.ku.ac.th"
 SOURCE_HEADER = "Content-Disposition"
 HEADER_MATCH = "attachment.*filename=\\\"?([^\"]*)\\\"?"
+RETRY_DELAY = 1
+MANIFEST_FILE = "manifest.json"
+CHUNK_SIZE = 64 * 1024
+# Read once while single-threaded, os.umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+print_lock = threading.Lock()
+manifest_lock = threading.Lock()
+
+
+def log(username, message):
+	with print_lock:
+		if username is None:
+			print(message)
+		else:
+			print("[%s] %s" % (username, message))
+
+
+def load_manifest(parent_dir):
+	path = os.path.join(parent_dir, MANIFEST_FILE)
+	if not os.path.exists(path):
+		return {}
+	try:
+		f = open(path, "r")
+		manifest = json.load(f)
+		f.close()
+		return manifest
+	except Exception as e:
+		log(None, "Invalid manifest, fetching everything again (%s)" % (e))
+		return {}
+
+
+def save_manifest(parent_dir, manifest):
+	with manifest_lock:
+		if not os.path.exists(parent_dir):
+			os.makedirs(parent_dir)
+		path = os.path.join(parent_dir, MANIFEST_FILE)
+		f = open(path + ".tmp", "w")
+		json.dump(manifest, f, indent=1, sort_keys=True)
+		f.close()
+		replace_file(path + ".tmp", path)
+
+
+def conditional_headers(entry, path):
+	# Only ask for a conditional response if the previous copy is still there
+	headers = {}
+	if entry is None or not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+		return headers
+	if entry.get("etag"):
+		headers["If-None-Match"] = entry["etag"]
+	if entry.get("last_modified"):
+		headers["If-Modified-Since"] = entry["last_modified"]
+	return headers
+
+
+def open_source(grader, link, headers):
+	# Returns None when the grader reports the source as not modified
+	try:
+		response = grader.stream(link, headers)
+		if SOURCE_HEADER not in response.info() and response.info().gettype() == "text/html":
+			# Got the login page instead of the source, session has expired
+			response.close()
+			grader.login()
+			response = grader.stream(link, headers)
+		return response
+	except mechanize.HTTPError as e:
+		if e.code == 304:
+			return None
+		raise
+
+
+def save_source(response, path):
+	# Streams the response into a temporary file next to path. Returns the
+	# temporary file name, its size and SHA-1.
+	fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=os.path.dirname(path))
+	size = 0
+	digest = hashlib.sha1()
+	try:
+		f = os.fdopen(fd, "wb")
+		while True:
+			chunk = response.read(CHUNK_SIZE)
+			if not chunk:
+				break
+			f.write(chunk)
+			digest.update(chunk)
+			size += len(chunk)
+		f.close()
+		# mkstemp creates the file owner-only, sources follow the umask
+		# as they did when written with open()
+		os.chmod(tmp_path, 0o666 & ~UMASK)
+	except Exception:
+		os.remove(tmp_path)
+		raise
+	finally:
+		response.close()
+	return (tmp_path, size, digest.hexdigest())
+
+
+def replace_file(tmp_path, path):
+	if os.name == "nt" and os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp_path, path)
+
+
+def with_retries(func, username, retries):
+	# Exponential backoff with jitter, login errors are never retried
+	attempt = 0
+	while True:
+		try:
+			return func()
+		except grader_client.LoginError:
+			raise
+		except Exception as e:
+			if attempt >= retries:
+				raise
+			delay = RETRY_DELAY * (2 ** attempt) * (1 + random.random())
+			log(username, "Grader Error! %s (retrying in %.1fs)" % (e, delay))
+			time.sleep(delay)
+			attempt += 1
+
+
+def fetch_user(username, password, outputname, parent_dir, retries, entries):
+	# Returns number of saved, unchanged and failed links. entries is the
+	# user's manifest (link -> file information) and is updated in place.
+	grader = grader_client.GraderSession(username, password)
+	log(username, "Opening grader...")
+	index_html = BeautifulSoup(with_retries(lambda: grader.open("/main/list").read(), username, retries))
+
+	download_links = set()
+	for link in index_html.find_all(name="a", text="[src]"):
+		download_links.add(link.get("href"))
+
+	if len(download_links) <= 0:
+		log(username, "No download link")
+		return (0, 0, 0)
+
+	saved = 0
+	unchanged = 0
+	failed = 0
+	for link in download_links:
+		entry = entries.get(link)
+		headers = {}
+		if entry is not None:
+			headers = conditional_headers(entry, os.path.join(parent_dir, outputname, entry["filename"]))
+		log(username, "Downloading %s..." % (link))
+		try:
+			response = with_retries(lambda: open_source(grader, link, headers), username, retries)
+		except Exception as e:
+			log(username, "Grader Error! %s" % (e))
+			failed += 1
+			continue
+		if response is None:
+			log(username, "Not modified \"%s\"" % (entry["filename"]))
+			unchanged += 1
+			continue
+		headers = response.info()
+		if SOURCE_HEADER not in headers:
+			log(username, "No desired header. Session timeout or invalid link maybe?")
+			response.close()
+			failed += 1
+			continue
+		header_match = re.search(HEADER_MATCH, headers[SOURCE_HEADER])
+		if header_match is None:
+			log(username, "Invalid header")
+			response.close()
+			failed += 1
+			continue
+		if header_match.groups < 1:
+			filename = os.path.basename(link)
+			log(username, "Warning! Potential invalid header match pattern")
+		else:
+			filename = header_match.group(1)
+		full_path = [parent_dir, outputname]
+		try:
+			os.makedirs(os.path.join(*full_path))
+		except Exception:
+			pass
+		full_path.append(filename)
+		path = os.path.join(*full_path)
+		try:
+			tmp_path, size, digest = save_source(response, path)
+		except Exception as e:
+			log(username, "Grader Error! %s" % (e))
+			failed += 1
+			continue
+		if entry is not None and entry["filename"] == filename and entry["sha1"] == digest and os.path.exists(path):
+			log(username, "Unchanged \"%s\"" % (filename))
+			os.remove(tmp_path)
+			unchanged += 1
+		else:
+			log(username, "Saving code as \"%s\" to \"%s\"" % (filename, outputname))
+			replace_file(tmp_path, path)
+			saved += 1
+		entries[link] = {
+			"filename": filename,
+			"size": size,
+			"sha1": digest,
+			"etag": headers.get("ETag"),
+			"last_modified": headers.get("Last-Modified")
+		}
+	return (saved, unchanged, failed)
+
+
+def worker(users, results, parent_dir, retries, manifest):
+	while True:
+		try:
+			username, password, outputname = users.get_nowait()
+		except queue.Empty:
+			return
+		try:
+			entries = dict(manifest.get(username, {}))
+			saved, unchanged, failed = fetch_user(username, password, outputname, parent_dir, retries, entries)
+			with manifest_lock:
+				manifest[username] = entries
+			save_manifest(parent_dir, manifest)
+			if failed > 0:
+				results[username] = "%d saved, %d unchanged, %d failed" % (saved, unchanged, failed)
+			else:
+				results[username] = None
+			log(username, "Done (%d saved, %d unchanged, %d failed)" % (saved, unchanged, failed))
+		except grader_client.LoginError:
+			results[username] = "Wrong password"
+			log(username, "Wrong password")
+		except Exception as e:
+			results[username] = str(e)
+			log(username, "Grader Error! %s" % (e))
+
 
 def run(args):
 	if len(args) < 2:
-		print("usage: %s <user file> [output directory]" % (args[0]))
+		print("usage: %s <user file> [output directory] [flags]" % (args[0]))
 		print("User file is a list of user information in this format: user,pwd[,output_name]")
 		print("Any invalid line will be skipped")
+		print("Flags:")
+		print("  -j <num>\t: Number of users to fetch concurrently (default is 4)")
+		print("  -retry <num>\t: Retries for each grader request (default is 3)")
 		return
 	parent_dir = "output"
-	if len(args) > 1:
-		parent_dir = args[2]
+	workers = 4
+	retries = 3
+	aid = 2
+	while aid < len(args):
+		if args[aid] == "-j":
+			if int(args[aid+1]) > 0:
+				workers = int(args[aid+1])
+			aid += 1
+		elif args[aid] == "-retry":
+			if int(args[aid+1]) >= 0:
+				retries = int(args[aid+1])
+			aid += 1
+		else:
+			parent_dir = args[aid]
+		aid += 1
 
 	f = open(args[1], "r")
 	if f is None:
@@ -25,8 +279,10 @@ def run(args):
 	user_list = f.read().split("\n")
 	f.close()
 
+	users = queue.Queue()
+	total = 0
 	for user in user_list:
-		user_info = user.split(",")
+		user_info = user.strip().split(",")
 		if len(user_info) < 2:
 			continue
 		username = user_info[0]
@@ -34,64 +290,25 @@ def run(args):
 		outputname = username
 		if len(user_info) > 2:
 			outputname = user_info[2]
+		users.put((username, password, outputname))
+		total += 1
 
-		br = mechanize.Browser()
-		br.set_handle_robots(False)
-		try:
-			br.open(GRADER_BASE)
-		except Exception as msg:
-			print("Grader Error! %s" % (msg))
-			return
-		if len(list(br.forms())) < 1:
-			print("No login form in grader... Please check the grader...")
-			return
-		br.form = list(br.forms())[0]
-		br.form["login"] = username
-		br.form["password"] = password
-		print("Logging into grader as \"%s\"..." % (username))
-		br.submit()
-
-		index_html = BeautifulSoup(br.response().read())
-
-		download_links = set()
-		for link in index_html.find_all(name="a", text="[src]"):
-			download_links.add(link.get("href"))
-
-		if len(download_links) <= 0:
-			print("[%s] No download link" % (username))
-			continue
-
-		for link in download_links:
-			print("[%s] Downloading %s..." % (username, link))
-			try:
-				response = br.open(GRADER_BASE+link)
-			except Exception as e:
-				print("[%s] Grader Error! %s" % (username, e))
-				continue
-			headers = response.info()
-			if SOURCE_HEADER not in headers:
-				print("[%s] No desired header. Session timeout or invalid link maybe?" % (username))
-				continue
-			header_match = re.search(HEADER_MATCH, headers[SOURCE_HEADER])
-			if header_match is None:
-				print("[%s] Invalid header" % (username))
-				continue
-			if header_match.groups < 1:
-				filename = os.path.basename(link)
-				print("[%s] Warning! Potential invalid header match pattern" % (username))
-			else:
-				filename = header_match.group(1)
-			full_path = [parent_dir, outputname]
-			try:
-				os.makedirs(os.path.join(*full_path))
-			except Exception:
-				pass
-			full_path.append(filename)
-			print("[%s] Saving code as \"%s\" to \"%s\"" % (username, filename, outputname))
-			f = open(os.path.join(*full_path), "w")
-			f.write(response.read())
-			f.close()
+	manifest = load_manifest(parent_dir)
+	results = {}
+	threads = []
+	for i in range(min(workers, total)):
+		thread = threading.Thread(target=worker, args=(users, results, parent_dir, retries, manifest))
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		while thread.is_alive():
+			thread.join(1)
 
+	failures = [username for username in results if results[username] is not None]
+	log(None, "Fetched %d of %d users" % (total - len(failures), total))
+	for username in sorted(failures):
+		log(username, "Failed: %s" % (results[username]))
 
 
 if __name__ == "__main__":